@@ -8,20 +8,25 @@ from datetime import datetime
 from paramiko import SSHClient, RSAKey, DSSKey, ECDSAKey, Ed25519Key
 from paramiko.ssh_exception import BadAuthenticationType, AuthenticationException
 from stat import S_ISDIR, S_ISREG
-from fileinput import FileInput
+from concurrent.futures import ThreadPoolExecutor
 import os
 import json
-import hashlib
 import logging
+import threading
 
 from pathlib import Path
 from config import Config, create_from_json
 from .sshfp import DnssecPolicy
 from ..helper.file.checksum import ChecksumLib
+from ..helper.file.dedup import ChunkStore
+from ..helper.file.manifest import Manifest
 
 
 logger = logging.getLogger(__name__)
 
+# preferred checksum methods of the manifest, strongest first
+METHODS: list = ["sha512", "sha384", "sha256", "sha224", "sha1", 'md5']
+
 
 def print_verbose(msg: str) -> None:
     if VERBOSE:
@@ -37,31 +42,126 @@ def check_date(date) -> bool:
     return ret
 
 
-def download(sftp, path, local_path, server_base_path):
-    mode = sftp.stat(path).st_mode
+def download(sftp, path, local_path, server_base_path, transfers: list, existing: list):
+    """
+    create the local directories and collect the (remote, local) paths of the files that have to be transferred.
+    Existing local files with the size of the remote file are collected in existing, their content is compared
+    against the manifest by compare()
+    """
+    attributes = sftp.stat(path)
     local_get_path = local_path + path.split(server_base_path)[1][1:]
     # regular file
-    if S_ISREG(mode):
+    if S_ISREG(attributes.st_mode):
         # check if local file exists
         if os.path.isfile(local_get_path):
             # check if remote and local file have the same size
-            if os.stat(local_get_path).st_size != sftp.stat(path).st_size:
+            if os.stat(local_get_path).st_size != attributes.st_size:
                 # re-download file if size of remote and local is different
                 print_verbose(f'- {path} (remote) != {local_get_path} (local), exists but has a different file size!')
-                print_verbose(f'- {path} (remote) => {local_get_path} (local)')
-                sftp.get(f'{path}', f'{local_get_path}')
+                transfers.append((path, local_get_path))
             else:
-                # if the size is ok skip the download
-                print_verbose(f'- {path} (remote) == {local_get_path} (local), skipping!')
+                existing.append((path, local_get_path))
         else:
-            print_verbose(f'- {path} (remote) => {local_get_path} (local)')
-            sftp.get(f'{path}', f'{local_get_path}')
-    elif S_ISDIR(mode):
+            transfers.append((path, local_get_path))
+    elif S_ISDIR(attributes.st_mode):
         # if the current path ends in a directory, create all sub directories
         for file in sftp.listdir(path):
             if not os.path.isdir(local_get_path):
                 os.mkdir(local_get_path)
-            download(sftp, path=f'{path}/{file}', local_path=local_path, server_base_path=server_base_path)
+            download(sftp, path=f'{path}/{file}', local_path=local_path, server_base_path=server_base_path,
+                     transfers=transfers, existing=existing)
+
+
+def download_manifest(sftp, local_path: str, server_path: str) -> Manifest:
+    """
+    the manifest decides whether existing files have to be downloaded again, so it's always fetched first.
+    Returns None if the backup has no manifest
+    """
+    manifest = Manifest(Path(local_path) / Manifest.FILE_NAME)
+    try:
+        sftp.get(f'{server_path}/{Manifest.FILE_NAME}', str(manifest.path))
+    except IOError:
+        manifest.path.unlink(missing_ok=True)
+        return None
+    return manifest
+
+
+def manifest_method(manifest: Manifest) -> str:
+    available = manifest.header().get('algorithms', [])
+    return next((m for m in METHODS if m in available), None) or next(iter(available), None)
+
+
+def compare(local_path: str, existing: list, manifest: Manifest, transfers: list, verified: set,
+            workers: int) -> None:
+    """
+    add the existing files whose checksum differs from the manifest to transfers. Files the manifest doesn't list
+    (or all files, without a manifest) are only compared by their size. The manifest paths of the files which
+    match are added to verified, so verify() doesn't hash them again
+    """
+    method = manifest_method(manifest) if manifest else None
+    if not method:
+        for path, local_get_path in existing:
+            print_verbose(f'- {path} (remote) == {local_get_path} (local), same size, skipping!')
+        return
+
+    local_base = Path(local_path)
+
+    def check(item: tuple) -> str:
+        """the manifest path of a matching file, '' if it isn't listed and None if it differs"""
+        local_get_path = Path(item[1])
+        relpath = local_get_path.relative_to(local_base).as_posix()
+        entry = manifest.lookup(relpath)
+        if entry is None:
+            return ''
+        same = str(ChecksumLib().get_checksum_file(local_get_path, method)) == entry['digests'][method]
+        return relpath if same else None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (path, local_get_path), relpath in zip(existing, executor.map(check, existing)):
+            if relpath is not None:
+                print_verbose(f'- {path} (remote) == {local_get_path} (local), skipping!')
+                if relpath:
+                    verified.add(relpath)
+            else:
+                print_verbose(f'- {path} (remote) != {local_get_path} (local), exists but has a different checksum!')
+                transfers.append((path, local_get_path))
+
+
+def download_chunks(local_path: str, server_location: str, transfers: list):
+    """
+    collect the chunks the deduplicated backups of the downloaded date reference, they're stored next to the date
+    folders (in .chunks) on both sides. Chunks are content addressed, so existing chunks aren't downloaded again
+    """
+    local_base = Path(local_path).parent
+    for digest in sorted(ChunkStore.referenced(Path(local_path).glob(f'*{ChunkStore.INDEX_SUFFIX}'))):
+        relpath = ChunkStore.chunk_path(digest)
+        local_chunk = local_base / relpath
+        if local_chunk.is_file():
+            continue
+        local_chunk.parent.mkdir(parents=True, exist_ok=True)
+        transfers.append((f'{server_location.rstrip("/")}/{relpath}', str(local_chunk)))
+
+
+def transfer(ssh, transfers: list, workers: int) -> None:
+    """download the files with a pool of workers, each with its own sftp session (e.g. the volumes of an archive)"""
+    sessions = list()
+    local = threading.local()
+
+    def get(item: tuple) -> None:
+        if not hasattr(local, 'sftp'):
+            local.sftp = ssh.open_sftp()
+            sessions.append(local.sftp)
+        path, local_get_path = item
+        print_verbose(f'- {path} (remote) => {local_get_path} (local)')
+        local.sftp.get(path, local_get_path)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(get, transfers):
+                pass
+    finally:
+        for session in sessions:
+            session.close()
 
 
 def main(config: Config) -> None:
@@ -131,41 +231,91 @@ def main(config: Config) -> None:
         os.mkdir(local_path)
 
     # download files, path is the starting point, server base path is for subtraction only
-    download(sftp=sftp, path=server_path, local_path=local_path, server_base_path=server_path)
-
-    methods: list = ["sha512", "sha384", "sha256", "sha224", "sha1", 'md5']
-
-    # update path definitions to match local path
-    for method in methods:
-        if os.path.isfile(f'{local_path}/{method}sum.txt'):
-            with FileInput(f'{local_path}/{method}sum.txt', inplace=True, backup='.bak') as file:
-                for line in file:
-                    line.replace(server_path, local_path)
-
-    # check check sums
-    best_available_method = next((m for m in methods if os.path.isfile(f'{local_path}/{m}sum.txt')), None)
-    if best_available_method:
-        with open(f'{local_path}/{best_available_method}sum.txt', 'r') as check_sum_file:
-            for entry in check_sum_file.readlines():
-                checksum, filepath = entry.split("\t")
-                filepath = os.path.basename(filepath.strip("\n"))
-                local_filepath = Path(local_path) / filepath
-                if not os.path.isfile(local_filepath):
-                    logger.warning(f"There is a check sum for %s, but the file does not exist", local_filepath)
-                if not ChecksumLib.get_checksum_file(local_filepath) == checksum:
-                    logger.warning(f"Checksum of  is not correct!" % filepath)
+    manifest = download_manifest(sftp, local_path, server_path)
+    transfers, existing, verified = list(), list(), set()
+    download(sftp=sftp, path=server_path, local_path=local_path, server_base_path=server_path, transfers=transfers,
+             existing=existing)
+    compare(local_path, existing, manifest, transfers, verified, WORKERS)
+    transfer(ssh, transfers, WORKERS)
+    # the indexes of the date have been downloaded, now the chunks they reference can be
+    transfers = list()
+    download_chunks(local_path, config.server_location, transfers)
+    transfer(ssh, transfers, WORKERS)
+
+    if not verify(local_path, server_path, WORKERS, verified):
+        exit(1)
+
+
+def verify(local_path: str, server_path: str, workers: int, verified: set = frozenset()) -> bool:
+    """
+    Verify the downloaded backup against the manifest (or the best available checksum file) with a pool of workers.
+    verified are the manifest paths compare() has already checked, they aren't hashed again.
+    Prints a summary and returns False if a file is missing or has a wrong checksum.
+    """
+    local_base = Path(local_path)
+    manifest = Manifest(local_base / Manifest.FILE_NAME)
+
+    # list of (relative path, algorithm, expected checksum)
+    expected = list()
+    if manifest.path.is_file():
+        method = manifest_method(manifest)
+        expected = [(entry['path'], method, entry['digests'][method]) for entry in manifest if method]
     else:
+        method = next((m for m in METHODS if (local_base / f'{m}sum.txt').is_file()), None)
+        if method:
+            with (local_base / f'{method}sum.txt').open('r') as check_sum_file:
+                for entry in check_sum_file:
+                    checksum, filepath = entry.rstrip("\n").split("\t", 1)
+                    # the checksum files contain the absolute path on the server
+                    if filepath.startswith(server_path):
+                        filepath = filepath[len(server_path):].lstrip('/')
+                    expected.append((filepath, method, checksum))
+
+    if not method:
         logger.warning("Unable to find check sums, skipping integrity check!")
+        return True
+
+    print_verbose(f'Verifying {len(expected)} files using {method} with {workers} workers')
+
+    def check(item: tuple) -> str:
+        filepath, algorithm, checksum = item
+        local_filepath = local_base / filepath
+        if not local_filepath.is_file():
+            return 'missing'
+        if filepath in verified:
+            return 'ok'
+        if str(ChecksumLib().get_checksum_file(local_filepath, algorithm)) != checksum:
+            return 'mismatch'
+        return 'ok'
+
+    failed = {'missing': list(), 'mismatch': list()}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item, status in zip(expected, executor.map(check, expected)):
+            if status != 'ok':
+                failed[status].append(item[0])
+
+    for filepath in failed['missing']:
+        logger.warning("There is a check sum for %s, but the file does not exist", filepath)
+    for filepath in failed['mismatch']:
+        logger.warning("Checksum of %s is not correct!", filepath)
+
+    errors = len(failed['missing']) + len(failed['mismatch'])
+    print(f"Integrity check: {len(expected) - errors} ok, {len(failed['mismatch'])} mismatched, "
+          f"{len(failed['missing'])} missing")
+    return errors == 0
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument('-q', '--quiet', help='less verbose output', action="store_false")
     parser.add_argument('-c', '--config', help='config file', nargs=1)
+    parser.add_argument('-w', '--workers', help='number of files to download and verify concurrently', type=int,
+                        default=os.cpu_count() or 1)
 
     # get arguments
     args = vars(parser.parse_args())
     VERBOSE = args.get('quiet')
+    WORKERS = max(1, args.get('workers'))
 
     config_file: str = args.get('config')[0] if args.get('config') else './.config.json'
 
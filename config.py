@@ -5,6 +5,8 @@ import os
 class Config:
     def __init__(self, json: dict):
         self.backup_dir: str = json.get('backup_dir') or '/home/backups'
+        # directory archives and database dumps are split into volumes of this size (bytes or K/M/G/T), 0 disables it
+        self.volume_size = json.get('volume_size') or 0
         self.mariadb: List[Config.MariaDB] = list()
         if json.get('mariadb'):
             for cfg in json.get('mariadb'):
@@ -19,8 +21,9 @@ class Config:
                 self.postgres.append(self.PostgreSQL(cfg))
         if json.get('gitlab'):
             self.gitlab = self.GitLab(json.get('gitlab'))
-        self.files: dict = json.get('files')
-        self.checksums: dict = json.get('checksums') or list()
+        self.databases: Config.Databases = self.Databases(json.get('databases'))
+        self.files: Config.Files = self.Files(json.get('files'))
+        self.checksums: Config.Checksums = self.Checksums(json.get('checksums'))
 
         if not isinstance(self.backup_dir, str):
             print("Error: Backup directory is not properly initialized! Exiting.")
@@ -41,7 +44,15 @@ class Config:
             self.username: str = json.get('username')
             self.password: str = json.get('password')
             self.databases: list = json.get('databases') or ['mysql']
+            # database (one sql file) or tables (every table dumped on its own by jobs parallel connections, per dump
+            # of the scheduler, so they multiply with per_container)
+            self.mode: str = json.get('mode') or 'database'
+            self.jobs: int = json.get('jobs') or 1
+            # dump in a transaction (InnoDB) instead of locking the tables, table dumps always do
+            self.single_transaction: bool = json.get('single_transaction') or False
             self.skip_existing: bool = json.get('skip_existing') or True
+            # dump a database which doesn't run in a container with the locally installed tools
+            self.local: bool = json.get('local') or False
 
     class MongoDB:
         def __init__(self, json: dict):
@@ -53,7 +64,11 @@ class Config:
             self.authentication_database: str = json.get('authentication_database') or 'admin'
             self.authentication_mechanism: str = json.get('authentication_mechanism') or 'SCRAM-SHA-1'
             self.databases: list = json.get('databases') or ['admin']
+            # collections mongodump dumps at the same time into the streamed archive
+            self.parallel_collections: int = json.get('parallel_collections') or 4
             self.skip_existing: bool = json.get('skip_existing') or True
+            # dump a database which doesn't run in a container with the locally installed tools
+            self.local: bool = json.get('local') or False
 
     class PostgreSQL:
         def __init__(self, json: dict):
@@ -63,7 +78,57 @@ class Config:
             self.username: str = json.get('username') or 'postgres'
             self.password: str = json.get('password')
             self.databases: list = json.get('databases') or ['postgres']
+            # plain (sql file) or directory (dumped by jobs parallel workers, restorable with pg_restore -j)
+            self.format: str = json.get('format') or 'plain'
+            self.jobs: int = json.get('jobs') or 1
             self.skip_existing: bool = json.get('skip_existing') or True
+            # dump a database which doesn't run in a container with the locally installed tools
+            self.local: bool = json.get('local') or False
+
+    class Databases:
+        def __init__(self, json: dict):
+            json = json or dict()
+            # dumps that run at the same time, in total and against the same container / server
+            self.workers: int = json.get('workers') or 4
+            self.per_container: int = json.get('per_container') or 1
+            # dumps of containers are streamed to the host and gzipped on the fly (0 disables the compression),
+            # without stream they're dumped into /tmp of the container and copied as tar archive
+            self.stream: bool = json.get('stream', True)
+            self.compression_level: int = json.get('compression_level', 6)
+            # probe databases for changes before they're dumped, the dump of the last backup is linked if unchanged
+            self.skip_unchanged: bool = json.get('skip_unchanged', True)
+
+    class Files:
+        def __init__(self, json):
+            # a plain list of paths is still accepted for older configuration files
+            if isinstance(json, list):
+                json = {'paths': json}
+            json = json or dict()
+            self.paths: list = json.get('paths') or list()
+            self.workers: int = json.get('workers') or 0
+            self.compression_level: int = json.get('compression_level') or 6
+            self.mode: str = json.get('mode') or 'full'
+            self.full_interval: int = json.get('full_interval') or 7
+            self.storage: str = json.get('storage') or 'archive'
+            self.format: str = json.get('format') or 'tar.gz'
+            self.scan_workers: int = json.get('scan_workers') or 4
+            # patterns and size limit for all sources, a path can also be a dict with its own path, include,
+            # exclude (added to the global ones) and max_file_size
+            self.include: list = json.get('include') or list()
+            self.exclude: list = json.get('exclude') or list()
+            self.max_file_size = json.get('max_file_size') or 0
+            self.sources: list = [p if isinstance(p, dict) else {'path': p} for p in self.paths]
+
+    class Checksums:
+        def __init__(self, json):
+            # a plain list of methods is still accepted for older configuration files
+            if isinstance(json, list):
+                json = {'methods': json}
+            json = json or dict()
+            self.methods: list = json.get('methods') or ['sha256']
+            self.workers: int = json.get('workers') or 1
+            self.cache: bool = json.get('cache', True)
+            self.mmap: bool = json.get('mmap') or False
 
     class GitLab:
         def __init__(self, json: dict):
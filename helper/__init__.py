@@ -5,3 +5,6 @@ from .postgresql import PostgreSQL
 from .files import File
 from .gitlab import GitLab
 from .checksums import Checksums
+from .file.cache import InlineDigests
+from .file.dedup import ChunkStore
+from .scheduler import DumpScheduler
@@ -1,18 +1,35 @@
 import logging
+import os
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
 from pathlib import Path
+from typing import List, Optional
 
+from .file.cache import ChecksumCache
 from .file.checksum import ChecksumLib
+from .file.dedup import ChunkStore
+from .file.manifest import Manifest
+from .file.merkle import MerkleTree
+from .file.scanner import TreeScanner
 
 
 logger = logging.getLogger(__name__)
 
 
 class Checksums:
+    # files smaller than this are hashed in batches, so the pool overhead doesn't dominate
+    _BATCH_SIZE = 8 * 1024 * 1024
+    _BATCH_FILES = 64
 
-    def __init__(self, path: str = '/home/backups', methods: list = ['sha256']):
+    def __init__(self, path: str = '/home/backups', methods: list = ['sha256'], workers: int = 1,
+                 cache: bool = True, use_mmap: bool = False):
         self.methods = Checksums._check_methods(methods)
+        self.workers = max(1, workers or 1)
+        self.use_mmap = use_mmap
+        # the cache lives next to the date folders, so it's not part of the backup itself
+        self.cache_path: Path = Path(path) / ChecksumCache.FILE_NAME if cache else None
 
         # path where the backup should be stored
         date = datetime.now().strftime("%Y-%m-%d")
@@ -22,22 +39,121 @@ class Checksums:
             self.path.mkdir()
 
     def generate_all(self):
-        cl = ChecksumLib()
-
-        for method in self.methods:
-            cf = self.path / f'{method}sum.txt'
+        sum_files = {method: self.path / f'{method}sum.txt' for method in self.methods}
+        for cf in sum_files.values():
             if cf.exists():
                 logger.info("File '%s' already exists but will be removed", cf)
                 cf.unlink()
 
-        for file in self.path.rglob("*"):
-            if not file.is_file():
+        manifest = Manifest(self.path / Manifest.FILE_NAME)
+        tree_path = self.path / MerkleTree.FILE_NAME
+        for path in (manifest.path, tree_path):
+            if path.exists():
+                logger.info("File '%s' already exists but will be removed", path)
+                path.unlink()
+
+        # collect the files before the checksum files get created, so they don't checksum themselves
+        scanned = TreeScanner(self.path, self.workers).scan()
+        stats = {Path(entry.path): entry.stat for entry in scanned if entry.is_file()}
+        dirs = [entry.relpath for entry in scanned if entry.is_dir() and entry.relpath]
+        stats.update(self._chunks())
+        files = sorted(stats)
+
+        cache = ChecksumCache(self.cache_path) if self.cache_path else None
+        results = dict()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for batch in executor.map(lambda b: self._hash_batch(b, cache), self._batches(files, stats)):
+                    results.update(batch)
+            if cache:
+                cache.evict_missing()
+        finally:
+            if cache:
+                cache.close()
+
+        with ExitStack() as stack:
+            handles = {method: stack.enter_context(cf.open('w')) for method, cf in sum_files.items()}
+            for file in files:
+                checksums = results.get(file)
+                if not checksums:
+                    continue
+                for method, c in checksums.items():
+                    handles[method].write(f'{c}\t{file}\n')
+
+        manifest.write(
+            (Manifest.entry(Path(os.path.relpath(file, self.path)).as_posix(), stats[file].st_size,
+                            stats[file].st_mtime_ns,
+                            {method: str(c) for method, c in results[file].items()})
+             for file in files if results.get(file)),
+            date=self.path.name, algorithms=sorted(self.methods)
+        )
+        self._save_tree(tree_path, dirs, results)
+
+    def compare(self, date: str, other: str) -> List[str]:
+        """
+        files which differ between the backups of two dates, according to their Merkle trees
+        only the subtrees with different digests are visited, nothing is hashed again
+        """
+        base = self.path.parent
+        tree = MerkleTree.load(base / date / MerkleTree.FILE_NAME)
+        return tree.diff(MerkleTree.load(base / other / MerkleTree.FILE_NAME))
+
+    # the Merkle tree of the date (the chunks of deduplicated backups aren't part of it), the files which changed
+    # since the last date with a tree are logged
+    def _save_tree(self, tree_path: Path, dirs: List[str], results: dict):
+        algorithm = 'sha256' if 'sha256' in self.methods else min(self.methods, default=None)
+        if not algorithm:
+            return
+        digests = {file.relative_to(self.path).as_posix(): str(checksums[algorithm])
+                   for file, checksums in results.items() if checksums and self.path in file.parents}
+        MerkleTree.from_digests(algorithm, digests, dirs).save(tree_path)
+
+        previous = self._previous_tree()
+        if not previous:
+            return
+        try:
+            changed = self.compare(self.path.name, previous)
+        except ValueError as e:
+            logger.info("Unable to compare with the backup of %s: %s", previous, e)
+            return
+        logger.info("%d files differ from the backup of %s", len(changed), previous)
+        for path in changed:
+            logger.debug("Changed since %s: %s", previous, path)
+
+    def _previous_tree(self) -> Optional[str]:
+        dates = (tree.parent.name for tree in self.path.parent.glob(f'*/{MerkleTree.FILE_NAME}'))
+        return max((date for date in dates if date < self.path.name), default=None)
+
+    def _chunks(self) -> dict:
+        """the chunks the deduplicated backups of the date reference, they're stored next to the date folders"""
+        stats = dict()
+        for digest in ChunkStore.referenced(self.path.glob(f'*{ChunkStore.INDEX_SUFFIX}')):
+            chunk = self.path.parent / ChunkStore.chunk_path(digest)
+            try:
+                stats[chunk] = chunk.stat()
+            except FileNotFoundError:
+                logger.error("Chunk '%s' is missing", chunk)
+        return stats
+
+    def _hash_batch(self, files: List[Path], cache: ChecksumCache = None) -> dict:
+        cl = ChecksumLib(cache=cache, use_mmap=self.use_mmap)
+        return {file: cl.get_checksums_file(file, self.methods) for file in files}
+
+    # group small files together, large files are hashed on their own
+    def _batches(self, files: List[Path], stats: dict):
+        batch, batch_size = list(), 0
+        for file in files:
+            size = stats[file].st_size
+            if size >= self._BATCH_SIZE:
+                yield [file]
                 continue
-            for method in self.methods:
-                cf = self.path / f'{method}sum.txt'
-                with cf.open('a') as f:
-                    c = cl.get_checksum_file(file, method)
-                    f.write(f'{c}\t{file}\n')
+            batch.append(file)
+            batch_size += size
+            if batch_size >= self._BATCH_SIZE or len(batch) >= self._BATCH_FILES:
+                yield batch
+                batch, batch_size = list(), 0
+        if batch:
+            yield batch
 
     # check if the check sums from the config file are all valid method names from the hashlib module
     @staticmethod
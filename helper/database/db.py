@@ -1,10 +1,23 @@
+import json
+import hashlib
 import logging
+import os
+import re
+import shlex
+import subprocess
+import threading
+import time
 
+from contextlib import nullcontext
 from datetime import datetime
 from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, List, Optional, Tuple
 
 from docker.models.containers import Container
 
+from ..file.compress import ParallelGzipWriter
+from ..file.volume import VolumeWriter, open_writer
+
 
 logger = logging.getLogger(__name__)
 
@@ -27,22 +40,43 @@ class _Database:
     _DUMB_CMD = ""
     _FILE_PARAM = ""
     _DUMB_FILE_EXT = ""
+    # argument that makes the dump tool write to stdout, the extension of the streamed dump and whether it's
+    # compressed by the tool already
+    _STREAM_PARAM = ""
+    _STREAM_FILE_EXT = ""
+    _STREAM_COMPRESSED = False
     _PARAM_NAMES = {}
+    # environment variable the dump tool reads the password from, so it's not visible in the process list
+    _PASSWORD_ENV = ""
+    # bytes of stderr that are kept for the error message of a failed dump
+    _STDERR_LIMIT = 64 * 1024
+    _CHUNK_SIZE = 1024 * 1024
 
     def __init__(self, dbname: str = '', host: str = 'localhost', port: int = 0, username: str = '',
-                 path: str = '/home/backups', container: Container = None, skip_existing: bool = True):
+                 path: str = '/home/backups', container: Container = None, skip_existing: bool = True,
+                 volume_size: int = 0, stream: bool = True, compression_level: int = 6, skip_unchanged: bool = True):
         params = dict()
         params['host'] = host
         params['port'] = port
         params['username'] = username
         self._params = params
 
+        self._password = ''
         self._container = container
         self._skip_existing = skip_existing
+        # dumps are split into volumes of this size, 0 writes a single file
+        self._volume_size = volume_size
+        # stream dumps out of the container (instead of copying a file which is dumped into its /tmp) and gzip them
+        # on the fly with compression_level, 0 writes them uncompressed
+        self._stream = stream
+        self._compression_level = compression_level
+        # probe the database before it's dumped and link the dump of the last backup if nothing has been changed
+        self._skip_unchanged = skip_unchanged
         self._dbname = dbname if dbname else self._DB_NAME
 
-        date = datetime.now().strftime("%Y-%m-%d")
-        self._path: Path = Path(path) / date / (container.name if container else self._dbname)
+        self._backup_dir = Path(path)
+        self._date = datetime.now().strftime("%Y-%m-%d")
+        self._path: Path = Path(path) / self._date / (container.name if container else self._local_dir())
         if not self._path.exists():
             logger.info("Create backup folder")
             self._path.mkdir(parents=True)
@@ -60,15 +94,128 @@ class _Database:
             self.backup_db(db)
 
     def backup_db(self, db: str) -> dict:
-        _backup = self._container_db if self._container else self._local_db
-        backup_path = self._path / (f"{db}.tar" if self._container else f"{db}{self._DUMB_FILE_EXT}")
-
-        if backup_path.exists() and self._skip_existing:
+        _backup, backup_path = self._dump_target(db)
+        if (backup_path.exists() or VolumeWriter.is_complete(backup_path)) and self._skip_existing:
             logger.info("%s Database %s backup already exists. Skipping!", self._dbname, db)
             return None
 
+        # the marker is probed before the dump, changes during the dump show up in the next probe
+        marker = self._marker(db) if self._skip_unchanged else None
+        if marker:
+            result = self._link_unchanged(db, backup_path, marker)
+            if result:
+                return result
+
         logger.debug("%s Database %s backup has been started!", self._dbname, db)
-        return _backup(db, backup_path)
+        result = _backup(db, backup_path)
+        if marker:
+            self._save_state(db, marker, backup_path, self._artifacts(backup_path), result['size'])
+        return result
+
+    def _probe(self, db: str) -> Optional[str]:
+        """cheap value that changes whenever db is written to, None if the database can't tell"""
+        return None
+
+    def _marker(self, db: str) -> Optional[str]:
+        try:
+            return self._probe(db)
+        except Exception as e:
+            logger.warning("%s Database %s: unable to probe for changes, dumping it (%s)", self._dbname, db, e)
+            return None
+
+    def _link_unchanged(self, db: str, path: Path, marker: str) -> Optional[dict]:
+        """hardlink the files of the last dump of db to path if the marker is still the same"""
+        state = self._load_state(db)
+        # the dump of an older backup with other settings (e.g. compression or mode) is not reused
+        if state.get('marker') != marker or state.get('name') != path.name or state['date'] >= self._date:
+            return None
+        previous = [self._backup_dir / file for file in state['files']]
+        if not previous or not all(file.is_file() for file in previous):
+            return None
+
+        date_dir = self._backup_dir / state['date']
+        linked = list()
+        try:
+            for file in previous:
+                # relative to the server folder of that date, local ones had no host and port in their name before
+                target = self._path.joinpath(*file.relative_to(date_dir).parts[1:])
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.link(file, target)
+                linked.append(target)
+        except OSError as e:
+            # e.g. different filesystems or too many links, dump it instead
+            logger.warning("%s Database %s: unable to link the last dump (%s)", self._dbname, db, e)
+            for target in linked:
+                target.unlink()
+            return None
+
+        self._save_state(db, marker, path, linked, state.get('size', 0))
+        logger.info("%s Database %s is unchanged, linked the dump of %s", self._dbname, db, state['date'])
+        return {'name': path.name, 'size': state.get('size', 0), 'unchanged': True}
+
+    def _artifacts(self, path: Path) -> List[Path]:
+        """the files written by the dump to path"""
+        if VolumeWriter.is_complete(path):
+            return VolumeWriter.files(path)
+        return [path] if path.is_file() else list()
+
+    # local servers of the same kind are told apart by host and port, e.g. mysql_localhost_3306
+    def _local_dir(self) -> str:
+        host = re.sub(r'[^\w.-]', '_', str(self._params['host']))
+        return f"{self._dbname}_{host}_{self._params['port']}"
+
+    # keyed by the container or the host:port of the server
+    def _state_path(self, db: str) -> Path:
+        server = self._container.name if self._container else f"{self._params['host']}:{self._params['port']}"
+        return self._backup_dir / '.state' / 'databases' / f'{self._dbname}.{server}.{db}.json'
+
+    def _load_state(self, db: str) -> dict:
+        try:
+            with self._state_path(db).open('r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    def _save_state(self, db: str, marker: str, path: Path, files: List[Path], size: int):
+        state_path = self._state_path(db)
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = state_path.with_name(state_path.name + '.tmp')
+        with tmp.open('w') as f:
+            json.dump({'marker': marker, 'date': self._date, 'name': path.name, 'size': size,
+                       'files': [str(file.relative_to(self._backup_dir)) for file in files]}, f,
+                      separators=(',', ':'))
+        tmp.replace(state_path)
+
+    def _query(self, db: str, client: List[str]) -> str:
+        """output of a client of the database (e.g. mysql --execute=<query>), run in the container or locally"""
+        args = list(client)
+        args += [f"{self._PARAM_NAMES[key]}{value}" for key, value in self._params.items()
+                 if value and (key != 'password' or self._container or not self._PASSWORD_ENV)]
+        args.append(db)
+
+        if self._container:
+            exit_code, (stdout, stderr) = self._container.exec_run(args, demux=True)
+        else:
+            try:
+                result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self._env())
+            except OSError as e:
+                raise RuntimeError(f"{args[0]}: {e}")
+            exit_code, stdout, stderr = result.returncode, result.stdout, result.stderr
+        if exit_code != 0:
+            error = (stderr or b'')[-self._STDERR_LIMIT:].decode(errors='replace').strip()
+            raise RuntimeError(f"{args[0]} exited with {exit_code}: {error}")
+        return (stdout or b'').decode()
+
+    @staticmethod
+    def _hash(output: str) -> str:
+        return hashlib.sha256(output.encode()).hexdigest()
+
+    def _dump_target(self, db: str) -> Tuple[Callable[[str, Path], dict], Path]:
+        """the method that dumps db and the path of the dump"""
+        if self._container and not self._stream:
+            return self._container_db, self._path / f"{db}.tar"
+        backup_path = self._path / f"{db}{self._STREAM_FILE_EXT}{'.gz' if self._compress() else ''}"
+        return (self._stream_container_db if self._container else self._local_db), backup_path
 
     def _build_cmd(self, db: str, path_save_arg: str) -> str:
         cmd = f"sh -c '{self._DUMB_CMD} {self._PARAM_NAMES['db']}{db}"
@@ -78,6 +225,21 @@ class _Database:
         logger.debug("Executing: %s", cmd)
         return cmd
 
+    def _build_args(self, db: str, stream_arg: str) -> List[str]:
+        """argument list of the dump tool for local dumps, the password is passed by _PASSWORD_ENV if possible"""
+        params = {'db': db, **{key: value for key, value in self._params.items() if value}}
+        if self._PASSWORD_ENV:
+            params.pop('password', None)
+        args = shlex.split(self._DUMB_CMD)
+        for key, value in params.items():
+            name = self._PARAM_NAMES[key]
+            # names ending with a space take the value as separate argument (e.g. '--databases ')
+            args += [name.strip(), str(value)] if name.endswith(' ') else [f"{name}{value}"]
+        args += shlex.split(stream_arg)
+
+        logger.debug("Executing: %s", " ".join(args))
+        return args
+
     def _container_db(self, db: str, path: Path) -> bool:
         docker_path = f"/tmp/{db}{self._DUMB_FILE_EXT}"
         cmd = self._build_cmd(db, f"{self._FILE_PARAM}{docker_path}")
@@ -90,15 +252,113 @@ class _Database:
 
         logger.info("Copy Backup from %s to host ...", self._container.name)
         data, stat = self._container.get_archive(docker_path)
-        with open(path, 'wb') as f:
+        with open_writer(path, self._volume_size) as f:
             for d in data:
                 f.write(d)
+        self._container.exec_run(f"rm -f {docker_path}")
 
         logger.info("%s Database %s backup was successful", self._dbname, db)
         return stat
 
-    def _local_db(self, db: str, path: Path) -> bool:
-        pass
+    def _stream_container_db(self, db: str, path: Path, stream_arg: str = None, compress: bool = True) -> dict:
+        """
+        read the stdout of the dump tool through the exec socket and write it to path (compressed on the fly),
+        nothing is written to the disk of the container and only a few blocks are kept in memory
+        """
+        cmd = self._build_cmd(db, self._STREAM_PARAM if stream_arg is None else stream_arg)
+        api = self._container.client.api
+        exec_id = api.exec_create(self._container.id, cmd, stdout=True, stderr=True)['Id']
+        stderr = bytearray()
+
+        def stdout():
+            for out, err in api.exec_start(exec_id, stream=True, demux=True):
+                if err:
+                    self._keep_stderr(stderr, err)
+                if out:
+                    yield out
+
+        return self._write_dump(db, path, stdout(), lambda: self._exit_code(api, exec_id), stderr, compress)
+
+    def _local_db(self, db: str, path: Path, stream_arg: str = None, compress: bool = True) -> dict:
+        """
+        run the dump tool as subprocess (without a shell) and write its stdout to path (compressed on the fly),
+        stderr is read by a thread so neither pipe can fill up and block the dump
+        """
+        try:
+            args = self._build_args(db, self._STREAM_PARAM if stream_arg is None else stream_arg)
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self._env())
+        except OSError as e:
+            logger.error("%s Database %s backup was not successful! %s", self._dbname, db, e)
+            raise
+        stderr = bytearray()
+        reader = threading.Thread(target=self._read_stderr, args=(process.stderr, stderr), daemon=True)
+        reader.start()
+
+        def wait() -> int:
+            exit_code = process.wait()
+            reader.join()
+            return exit_code
+
+        try:
+            return self._write_dump(db, path, iter(lambda: process.stdout.read1(self._CHUNK_SIZE), b''), wait,
+                                    stderr, compress)
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+    def _write_dump(self, db: str, path: Path, stdout: Iterable[bytes], wait: Callable[[], int],
+                    stderr: bytearray, compress: bool = True) -> dict:
+        """write the output of a dump tool to path, the dump is removed if wait() doesn't return 0"""
+        try:
+            with open_writer(path, self._volume_size) as f, self._compressor(f, compress) as out:
+                for chunk in stdout:
+                    out.write(chunk)
+                exit_code = wait()
+                if exit_code != 0:
+                    raise RuntimeError(f"{self._DUMB_CMD} exited with {exit_code}")
+        except Exception:
+            logger.error("%s Database %s backup was not successful!", self._dbname, db)
+            logger.error(stderr.decode(errors='replace'))
+            path.unlink(missing_ok=True)
+            raise
+
+        logger.info("%s Database %s backup was successful", self._dbname, db)
+        return {'name': path.name, 'size': f.tell()}
+
+    # environment of local dump tools
+    def _env(self) -> dict:
+        env = dict(os.environ)
+        if self._PASSWORD_ENV and self._password:
+            env[self._PASSWORD_ENV] = self._password
+        return env
+
+    def _read_stderr(self, pipe: BinaryIO, stderr: bytearray):
+        for line in pipe:
+            self._keep_stderr(stderr, line)
+        pipe.close()
+
+    def _keep_stderr(self, stderr: bytearray, data: bytes):
+        stderr += data
+        del stderr[:-self._STDERR_LIMIT]
+
+    def _compress(self) -> bool:
+        return bool(self._compression_level) and not self._STREAM_COMPRESSED
+
+    def _compressor(self, f: BinaryIO, compress: bool = True):
+        if not compress or not self._compress():
+            return nullcontext(f)
+        return ParallelGzipWriter(f, level=self._compression_level)
+
+    @staticmethod
+    def _exit_code(api, exec_id: str) -> int:
+        # the stream may end shortly before the exec is reported as finished
+        while True:
+            result = api.exec_inspect(exec_id)
+            if not result.get('Running'):
+                return result.get('ExitCode')
+            time.sleep(0.1)
 
 
 class Database(_Database, metaclass=_MetaDatabase):
@@ -1,12 +1,45 @@
+import json
+import logging
+
+from datetime import datetime
+from typing import Optional
+
 from docker.models.containers import Container
 from .db import _Database
 
 
+logger = logging.getLogger(__name__)
+
+
 class MongoDB(_Database):
     _DB_NAME = "mongodb"
     _DUMB_CMD = 'mongodump'
     _FILE_PARAM = '--gzip --out='
     _DUMB_FILE_EXT = ".tar"
+    # mongodump writes a (gzip compressed) archive to stdout
+    _STREAM_PARAM = '--archive --gzip'
+    _STREAM_FILE_EXT = ".archive"
+    _STREAM_COMPRESSED = True
+    # mongosh replaces the mongo shell since MongoDB 6.0
+    _SHELLS = ('mongosh', 'mongo')
+    # the newest oplog entry of the database (including transactions) and the oldest entry of the oplog,
+    # nothing is printed if the server isn't part of a replica set (and has no oplog)
+    _OPLOG_SCRIPT = r"""
+function time(ts) {
+    // bson Timestamp of mongosh, Timestamp of the mongo shell
+    return ts.getHighBits ? [ts.getHighBits() >>> 0, ts.getLowBits() >>> 0] : [ts.t, ts.i];
+}
+if (db.isMaster().setName) {
+    var ns = '^' + db.getName().replace(/[.*+?^${}()|[\]\\]/g, '\\$&') + '\\.';
+    var oplog = db.getSiblingDB('local').oplog.rs;
+    var last = oplog.find({$or: [{ns: {$regex: ns}}, {'o.applyOps.ns': {$regex: ns}}]}, {ts: 1})
+        .sort({$natural: -1}).limit(1).toArray();
+    var first = oplog.find({}, {ts: 1}).sort({$natural: 1}).limit(1).toArray();
+    print(JSON.stringify({
+        last: last.length ? time(last[0].ts).join('.') : null,
+        first: first.length ? time(first[0].ts)[0] : null
+    }));
+}"""
     _PARAM_NAMES = {
         'host': '--host=',
         'port': '--port=',
@@ -19,13 +52,45 @@ class MongoDB(_Database):
 
     def __init__(self, host: str = 'localhost', port: int = 27017, username: str = '', password: str = '',
                  path: str = '/home/backups', container: Container = None, skip_existing: bool = True,
-                 authentication_database: str = 'admin', authentication_mechanism: str = 'SCRAM-SHA-1'):
+                 authentication_database: str = 'admin', authentication_mechanism: str = 'SCRAM-SHA-1',
+                 parallel_collections: int = 4, **kwargs):
         super(MongoDB, self).__init__(dbname=self._DB_NAME, host=host, port=port, username=username,
-                                      path=path, container=container, skip_existing=skip_existing)
+                                      path=path, container=container, skip_existing=skip_existing, **kwargs)
         if password:
             self._params['password'] = password
             self._params['authenticationDatabase'] = authentication_database
             self._params['authenticationMechanism'] = authentication_mechanism
+        # collections which are dumped at the same time into the streamed archive
+        if parallel_collections:
+            self._STREAM_PARAM = f"{MongoDB._STREAM_PARAM} --numParallelCollections={parallel_collections}"
+
+    def _probe(self, db: str) -> Optional[str]:
+        """
+        the time of the last write of db in the oplog, only replica sets have one. If the oplog doesn't contain a
+        write of db, it hasn't been written since the oldest entry of the oplog: the database is unchanged if that's
+        older than the last probe, otherwise a write may have been dropped from the oplog already
+        """
+        output = self._shell(db, self._OPLOG_SCRIPT).strip()
+        if not output:
+            logger.info("%s Database %s isn't part of a replica set, dumping it", self._dbname, db)
+            return None
+        oplog = json.loads(output.splitlines()[-1])
+        if oplog['last']:
+            return oplog['last']
+        last_probe = self._load_state(db).get('date')
+        if oplog['first'] and last_probe and oplog['first'] <= datetime.strptime(last_probe, "%Y-%m-%d").timestamp():
+            return 'no writes in the oplog'
+        return None
+
+    def _shell(self, db: str, script: str) -> str:
+        """output of script, run by the first shell that is available"""
+        error = None
+        for shell in self._SHELLS:
+            try:
+                return self._query(db, [shell, '--quiet', '--eval', script])
+            except RuntimeError as e:
+                error = e
+        raise error
 
     @staticmethod
     def get_dbname() -> str:
@@ -1,23 +1,109 @@
+import json
+import logging
+import shlex
+import subprocess
+import tarfile
+import tempfile
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import quote
+
 from docker.models.containers import Container
 from .db import _Database
+from ..file.volume import open_writer
+from ..file.writer import HashingWriter
+
+
+logger = logging.getLogger(__name__)
 
 
 class PostgreSQL(_Database):
+    """
+    plain dumps are sql files, directory dumps (--format=directory) are written by jobs parallel workers of pg_dump
+    and stored as a tar archive of the directory, which can be restored in parallel by pg_restore -j
+    """
     _DB_NAME = "postgres"
     _DUMB_CMD = 'pg_dump'
     _FILE_PARAM = '> '
     _DUMB_FILE_EXT = ".sql"
+    _STREAM_FILE_EXT = ".sql"
+    _DIRECTORY_FILE_EXT = ".dir.tar"
+    _PASSWORD_ENV = "PGPASSWORD"
     _PARAM_NAMES = {
         'host': '--host=',
         'port': '--port=',
         'username': '--username=',
         'db': '--db='
     }
+    PLAIN = 'plain'
+    DIRECTORY = 'directory'
+    # the statistics are reset with the server, so the start time is part of the marker. pg_current_wal_lsn() isn't
+    # used, it's shared by all databases of the cluster and moves on without writes (e.g. checkpoints)
+    _CHANGES_QUERY = "SELECT tup_inserted, tup_updated, tup_deleted, stats_reset, pg_postmaster_start_time() " \
+                     "FROM pg_stat_database WHERE datname = current_database()"
 
     def __init__(self, host: str = 'localhost', port: int = 5432, username: str = 'postgres', password: str = '',
-                 path: str = '/home/backups', container: Container = None, skip_existing: bool = True):
+                 path: str = '/home/backups', container: Container = None, skip_existing: bool = True,
+                 dump_format: str = PLAIN, jobs: int = 1, **kwargs):
         super(PostgreSQL, self).__init__(dbname=self._DB_NAME, host=host, port=port, username=username,
-                                         path=path, container=container, skip_existing=skip_existing)
+                                         path=path, container=container, skip_existing=skip_existing, **kwargs)
+        self._password = password
+        self._format = dump_format
+        self._jobs = max(1, jobs or 1)
+
+    def _dump_target(self, db: str) -> Tuple[Callable[[str, Path], dict], Path]:
+        if self._format != self.DIRECTORY:
+            return super(PostgreSQL, self)._dump_target(db)
+        backup_path = self._path / f"{db}{self._DIRECTORY_FILE_EXT}"
+        return (self._container_directory_db if self._container else self._local_directory_db), backup_path
+
+    def _probe(self, db: str) -> Optional[str]:
+        """
+        the row counters of the statistics (which include the system catalogs, so schema changes count as well),
+        they're flushed by the server within a few seconds
+        """
+        output = self._query(db, ['psql', '--no-psqlrc', '--tuples-only', '--no-align',
+                                  f"--command={self._CHANGES_QUERY}"]).strip()
+        return self._hash(output) if output else None
+
+    # pg_dump compresses the files of the directory itself
+    def _directory_args(self, directory: str) -> str:
+        return f"--format=directory --jobs={self._jobs} --compress={self._compression_level or 0} " \
+               f"--file={directory}"
+
+    def _container_directory_db(self, db: str, path: Path) -> dict:
+        """
+        the directory has to be written inside the container, it's streamed out as tar archive by the same command
+        and removed afterwards (also if the dump fails)
+        """
+        directory = f"/tmp/{db}.{uuid.uuid4().hex}"
+        stream_arg = f"{self._directory_args(directory)} && tar -C {directory} -cf - .; " \
+                     f"exit_code=$?; rm -rf {directory}; exit $exit_code"
+        return self._stream_container_db(db, path, stream_arg, compress=False)
+
+    def _local_directory_db(self, db: str, path: Path) -> dict:
+        """the directory is written next to the dump and archived into path once pg_dump has finished"""
+        with tempfile.TemporaryDirectory(prefix=f".{db}.", dir=self._path) as tmp:
+            directory = Path(tmp) / db
+            args = self._build_args(db, self._directory_args(str(directory)))
+            result = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=self._env())
+            if result.returncode != 0:
+                logger.error("%s Database %s backup was not successful!", self._dbname, db)
+                logger.error(result.stderr[-self._STDERR_LIMIT:].decode(errors='replace'))
+                raise RuntimeError(f"{self._DUMB_CMD} exited with {result.returncode}")
+
+            try:
+                with open_writer(path, self._volume_size) as f, tarfile.open(fileobj=f, mode='w|') as tar:
+                    tar.add(directory, arcname='.')
+            except Exception:
+                path.unlink(missing_ok=True)
+                raise
+
+        logger.info("%s Database %s backup was successful", self._dbname, db)
+        return {'name': path.name, 'size': f.tell()}
 
     @staticmethod
     def get_dbname() -> str:
@@ -25,10 +111,20 @@ class PostgreSQL(_Database):
 
 
 class MySQL(_Database):
+    """
+    database dumps are a single sql file. Table dumps (mode tables) are written by jobs parallel connections, every
+    table to <db>.tables/<table>.sql.gz, the schema (views, routines, events) to _schema.sql.gz and the list of
+    tables to <db>.tables.json, so a single table can be restored on its own.
+    Every table is dumped in its own transaction (--single-transaction), which doesn't block writers of InnoDB
+    tables, but the tables are only consistent on their own, not with each other.
+    The jobs connections are opened within a single dump of the DumpScheduler, they multiply with per_container.
+    """
     _DB_NAME = "mysql"
     _DUMB_CMD = 'mysqldump --lock-tables'
     _FILE_PARAM = '> '
     _DUMB_FILE_EXT = ".sql"
+    _STREAM_FILE_EXT = ".sql"
+    _PASSWORD_ENV = "MYSQL_PWD"
     _PARAM_NAMES = {
         'host': '--host=',
         'port': '--port=',
@@ -37,13 +133,117 @@ class MySQL(_Database):
         'protocol': '--protocol=',
         'db': '--databases '
     }
+    DATABASE = 'database'
+    TABLES = 'tables'
+    _TABLES_FILE_EXT = ".tables"
+    _SCHEMA_FILE = "_schema.sql"
+    _TRANSACTION_PARAM = '--single-transaction --skip-lock-tables'
+    # largest tables first, so the long dumps don't end up at the end of the queue
+    _TABLES_QUERY = "SELECT table_name FROM information_schema.tables " \
+                    "WHERE table_schema = DATABASE() AND table_type = 'BASE TABLE' " \
+                    "ORDER BY data_length + index_length DESC"
+    _MYSQL_CLIENT = ['mysql', '--batch', '--skip-column-names']
+    # everything that ends up in the dumps: tables (with their last write), views (by their definition, they don't
+    # have an update time), routines, triggers (replaced by drop and create) and events
+    _CHANGES_QUERY = "SELECT table_name, table_type, create_time, update_time FROM information_schema.tables " \
+                     "WHERE table_schema = DATABASE() UNION ALL " \
+                     "SELECT table_name, 'VIEW DEFINITION', MD5(view_definition), NULL FROM information_schema.views " \
+                     "WHERE table_schema = DATABASE() UNION ALL " \
+                     "SELECT routine_name, routine_type, created, last_altered FROM information_schema.routines " \
+                     "WHERE routine_schema = DATABASE() UNION ALL " \
+                     "SELECT trigger_name, 'TRIGGER', created, NULL FROM information_schema.triggers " \
+                     "WHERE trigger_schema = DATABASE() UNION ALL " \
+                     "SELECT event_name, 'EVENT', created, last_altered FROM information_schema.events " \
+                     "WHERE event_schema = DATABASE() ORDER BY 1, 2"
+    # MySQL 8 caches the update times for a day by default
+    _STATS_EXPIRY = 'information_schema_stats_expiry'
 
     def __init__(self, host: str = 'localhost', port: int = 3306, username: str = '', password: str = '',
-                 path: str = '/home/backups', container: Container = None, skip_existing: bool = True):
+                 path: str = '/home/backups', container: Container = None, skip_existing: bool = True,
+                 mode: str = DATABASE, jobs: int = 1, single_transaction: bool = False, **kwargs):
         super(MySQL, self).__init__(dbname=self._DB_NAME, host=host, port=port, username=username,
-                                    path=path, container=container, skip_existing=skip_existing)
+                                    path=path, container=container, skip_existing=skip_existing, **kwargs)
         self._params['protocol'] = 'tcp'
         self._params['password'] = password
+        self._password = password
+        self._mode = mode
+        self._jobs = max(1, jobs or 1)
+        # dump InnoDB databases in a transaction instead of locking their tables during the whole dump
+        if single_transaction:
+            self._DUMB_CMD = f"mysqldump {self._TRANSACTION_PARAM}"
+
+    def _dump_target(self, db: str) -> Tuple[Callable[[str, Path], dict], Path]:
+        if self._mode != self.TABLES:
+            return super(MySQL, self)._dump_target(db)
+        # the index is written last, the table dumps are complete once it exists
+        return self._tables_db, self._path / f"{db}{self._TABLES_FILE_EXT}.json"
+
+    def _tables_db(self, db: str, path: Path) -> dict:
+        tables = self._tables(db)
+        directory = self._path / f"{db}{self._TABLES_FILE_EXT}"
+        directory.mkdir(exist_ok=True)
+        suffix = f"{self._STREAM_FILE_EXT}{'.gz' if self._compress() else ''}"
+        # the schema without data: views, routines and events, the tables are created by their own dumps as well
+        dumps = [(None, directory / f"{self._SCHEMA_FILE}{'.gz' if self._compress() else ''}",
+                  f"{self._TRANSACTION_PARAM} --no-data --routines --events")]
+        dumps += [(table, directory / f"{quote(table, safe='')}{suffix}",
+                   f"{self._TRANSACTION_PARAM} --tables {self._quote(table)}") for table in tables]
+
+        dump = self._stream_container_db if self._container else self._local_db
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            futures = [executor.submit(dump, db, file, arg) for _, file, arg in dumps]
+            # every dump is waited for, the first error is raised afterwards
+            results = [future.result() for future in futures]
+
+        index = {
+            'database': db,
+            'schema': dumps[0][1].name,
+            'tables': [{'name': table, 'file': file.name, 'size': result['size']}
+                       for (table, file, _), result in zip(dumps[1:], results[1:])]
+        }
+        tmp = path.with_name(path.name + '.tmp')
+        with HashingWriter.open(tmp) as f:
+            f.write(json.dumps(index, indent=2).encode())
+        tmp.replace(path)
+
+        logger.info("%s Database %s: %d tables dumped by %d connections", self._dbname, db, len(tables), self._jobs)
+        return {'name': directory.name, 'size': sum(result['size'] for result in results)}
+
+    def _probe(self, db: str) -> Optional[str]:
+        """
+        the create and update times of all tables and routines. InnoDB only keeps the update time in memory, if a
+        table doesn't have one (e.g. not written since the server has been started) the database is dumped
+        """
+        query = self._CHANGES_QUERY
+        if self._query(db, self._MYSQL_CLIENT + [f"--execute=SHOW VARIABLES LIKE '{self._STATS_EXPIRY}'"]):
+            query = f"SET SESSION {self._STATS_EXPIRY} = 0; {query}"
+        output = self._query(db, self._MYSQL_CLIENT + [f"--execute={query}"])
+        for line in output.split('\n'):
+            fields = line.split('\t')
+            if len(fields) == 4 and fields[1] == 'BASE TABLE' and fields[3] == 'NULL':
+                logger.info("%s Database %s: table %s has no update time, dumping it", self._dbname, db, fields[0])
+                return None
+        return self._hash(output)
+
+    def _artifacts(self, path: Path) -> List[Path]:
+        if self._mode != self.TABLES:
+            return super(MySQL, self)._artifacts(path)
+        directory = path.with_name(path.name[:-len('.json')])
+        return sorted(file for file in directory.iterdir() if file.is_file()) + [path]
+
+    def _tables(self, db: str) -> List[str]:
+        """the base tables of db, queried by the mysql client of the container or the host"""
+        try:
+            output = self._query(db, self._MYSQL_CLIENT + [f"--execute={self._TABLES_QUERY}"])
+        except RuntimeError as e:
+            logger.error("%s Database %s: unable to list the tables! %s", self._dbname, db, e)
+            raise
+        return [line for line in output.split('\n') if line]
+
+    # table names are passed through the shell of the container, local dumps are split by shlex
+    def _quote(self, name: str) -> str:
+        quoted = shlex.quote(name)
+        return quoted.replace("'", "'\\''") if self._container else quoted
 
     @staticmethod
     def get_dbname() -> str:
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import logging
+import os
+import stat
+import tarfile
+import time
+import zipfile
+
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, Iterable, Union
+
+from .compress import ParallelGzipWriter, is_compressible
+from .scanner import ScanEntry
+
+try:
+    import grp
+    import pwd
+except ImportError:
+    grp = pwd = None
+
+
+logger = logging.getLogger(__name__)
+
+_ZIP_MIN_DATE = (1980, 1, 1, 0, 0, 0)
+_ZIP_MAX_DATE = (2107, 12, 31, 23, 59, 59)
+
+
+class TarArchive:
+    """tar archive, compressed as a whole by the ParallelGzipWriter"""
+    FORMAT = 'tar.gz'
+    SUFFIX = '.tar.gz'
+
+    def __init__(self, fileobj: BinaryIO, level: int = 6, workers: int = 0):
+        self._gz = ParallelGzipWriter(fileobj, level=level, workers=workers)
+        self._tar = tarfile.open(fileobj=self._gz, mode='w')
+        # (st_dev, st_ino) -> arcname of files with more than one link, later ones are archived as hardlinks
+        self._inodes = dict()
+        self.skipped = 0
+
+    @staticmethod
+    def is_archive(path: Union[str, Path]) -> bool:
+        return os.path.isfile(path) and tarfile.is_tarfile(path)
+
+    def add(self, path: Union[str, Path], arcname: str, recursive: bool = True):
+        self._tar.add(path, arcname=arcname, recursive=recursive)
+
+    def add_entries(self, entries: Iterable[ScanEntry], arcname: str):
+        """add scanned entries (parents first) below arcname, the headers are built from the stat of the scan"""
+        for entry in entries:
+            name = f'{arcname}/{entry.relpath}' if entry.relpath else arcname
+            info = self._tarinfo(entry, name)
+            if info is None:
+                logger.info("%s: unsupported file type, not archived", entry.path)
+                self.skipped += 1
+                continue
+            if not info.isreg():
+                self._tar.addfile(info)
+                continue
+            try:
+                f = open(entry.path, 'rb')
+            except FileNotFoundError:
+                # removed after the scan
+                continue
+            with f:
+                self._tar.addfile(info, _FixedSizeReader(f, info.size, entry.path))
+
+    def add_bytes(self, arcname: str, data: bytes, mtime: float):
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mtime = int(mtime)
+        self._tar.addfile(info, BytesIO(data))
+
+    # uncompressed size of all archived files
+    def source_size(self) -> int:
+        return sum(m.size for m in self._tar.getmembers() if m.isfile())
+
+    # same as TarFile.gettarinfo, without another lstat and with cached user and group names
+    def _tarinfo(self, entry: ScanEntry, name: str) -> tarfile.TarInfo:
+        st = entry.stat
+        info = tarfile.TarInfo(name)
+        inode = (st.st_dev, st.st_ino)
+        if stat.S_ISREG(st.st_mode):
+            if st.st_nlink > 1 and inode in self._inodes:
+                info.type, info.linkname = tarfile.LNKTYPE, self._inodes[inode]
+            else:
+                info.type, info.size = tarfile.REGTYPE, st.st_size
+                if st.st_nlink > 1:
+                    self._inodes[inode] = name
+        elif stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(st.st_mode):
+            info.type, info.linkname = tarfile.SYMTYPE, os.readlink(entry.path)
+        elif stat.S_ISFIFO(st.st_mode):
+            info.type = tarfile.FIFOTYPE
+        elif stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode):
+            info.type = tarfile.CHRTYPE if stat.S_ISCHR(st.st_mode) else tarfile.BLKTYPE
+            info.devmajor, info.devminor = os.major(st.st_rdev), os.minor(st.st_rdev)
+        else:
+            # sockets
+            return None
+        info.mode = st.st_mode
+        info.uid, info.gid = st.st_uid, st.st_gid
+        info.uname, info.gname = _uname(st.st_uid), _gname(st.st_gid)
+        info.mtime = st.st_mtime
+        return info
+
+    def close(self, complete: bool = True):
+        if complete:
+            self._tar.close()
+            self._gz.close()
+        else:
+            self._gz.abort()
+
+    def __enter__(self) -> TarArchive:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(complete=exc_type is None)
+
+
+class ZipArchive:
+    """
+    zip archive, every entry is compressed on its own: files which are already compressed (by extension or because
+    a sample doesn't shrink) are stored, everything else is deflated.
+    Symlinks are stored like Info-ZIP does (the target as content, S_IFLNK in the external attributes), so unzip
+    restores them as links. Timestamps outside of the range zip can store (1980 - 2107) are clamped. Fifos, sockets and devices can't be stored and are skipped.
+    """
+    FORMAT = 'zip'
+    SUFFIX = '.zip'
+
+    def __init__(self, fileobj: BinaryIO, level: int = 6, workers: int = 0):
+        self._out = _AbortableWriter(fileobj)
+        self._zip = zipfile.ZipFile(self._out, mode='w', compression=zipfile.ZIP_DEFLATED, compresslevel=level,
+                                    allowZip64=True, strict_timestamps=False)
+        self.links = 0
+        self.skipped = 0
+
+    @staticmethod
+    def is_archive(path: Union[str, Path]) -> bool:
+        return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+    def add(self, path: Union[str, Path], arcname: str, recursive: bool = True):
+        self._add(path, arcname)
+        if not recursive or not os.path.isdir(path) or os.path.islink(path):
+            return
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            rel = os.path.relpath(root, path)
+            prefix = arcname if rel == '.' else f'{arcname}/{Path(rel).as_posix()}'
+            for name in dirs + sorted(files):
+                self._add(os.path.join(root, name), f'{prefix}/{name}')
+
+    def add_entries(self, entries: Iterable[ScanEntry], arcname: str):
+        """add scanned entries (parents first) below arcname, the headers are built from the stat of the scan"""
+        for entry in entries:
+            name = f'{arcname}/{entry.relpath}' if entry.relpath else arcname
+            if entry.is_symlink():
+                self._add_link(entry.path, name, entry.stat)
+            elif entry.is_dir():
+                self._zip.writestr(self._zipinfo(name + '/', entry.stat), b'')
+            elif entry.is_file():
+                compression = zipfile.ZIP_DEFLATED if is_compressible(entry.path) else zipfile.ZIP_STORED
+                try:
+                    self._zip.write(entry.path, name, compress_type=compression)
+                except FileNotFoundError:
+                    # removed after the scan
+                    continue
+            else:
+                logger.info("%s: unsupported file type, not archived", entry.path)
+                self.skipped += 1
+
+    def add_bytes(self, arcname: str, data: bytes, mtime: float):
+        self._zip.writestr(arcname, data)
+
+    # uncompressed size of all archived files
+    def source_size(self) -> int:
+        return sum(i.file_size for i in self._zip.infolist() if not i.is_dir())
+
+    def close(self, complete: bool = True):
+        if self.links:
+            logger.info("%d symlinks archived as links", self.links)
+        # without the central directory a failed archive is never taken for a complete one
+        if not complete:
+            self._out.aborted = True
+        self._zip.close()
+
+    # same as ZipInfo.from_file, without another stat
+    @staticmethod
+    def _zipinfo(name: str, st: os.stat_result) -> zipfile.ZipInfo:
+        date_time = min(max(time.localtime(st.st_mtime)[:6], _ZIP_MIN_DATE), _ZIP_MAX_DATE)
+        info = zipfile.ZipInfo(name, date_time)
+        info.external_attr = (st.st_mode & 0xFFFF) << 16
+        if stat.S_ISDIR(st.st_mode):
+            info.external_attr |= 0x10
+        return info
+
+    def _add_link(self, path: Union[str, Path], arcname: str, st: os.stat_result):
+        info = self._zipinfo(arcname, st)
+        info.create_system = 3
+        self._zip.writestr(info, os.fsencode(os.readlink(path)), compress_type=zipfile.ZIP_STORED)
+        self.links += 1
+
+    def _add(self, path: Union[str, Path], arcname: str):
+        if os.path.islink(path):
+            self._add_link(path, arcname, os.lstat(path))
+        elif os.path.isfile(path):
+            compression = zipfile.ZIP_DEFLATED if is_compressible(path) else zipfile.ZIP_STORED
+            self._zip.write(path, arcname, compress_type=compression)
+        elif os.path.isdir(path):
+            self._zip.write(path, arcname)
+
+    def __enter__(self) -> ZipArchive:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(complete=exc_type is None)
+
+
+class _AbortableWriter:
+    """forwards writes to fileobj until it's aborted, afterwards they are dropped"""
+
+    def __init__(self, fileobj: BinaryIO):
+        self._fileobj = fileobj
+        self.aborted = False
+
+    def write(self, data: bytes) -> int:
+        return len(data) if self.aborted else self._fileobj.write(data)
+
+    def tell(self) -> int:
+        return self._fileobj.tell()
+
+    def flush(self):
+        if not self.aborted:
+            self._fileobj.flush()
+
+
+class _FixedSizeReader:
+    """
+    Reads exactly size bytes of a file whose header has already been written. A file that shrinks while it's
+    archived is padded with zeros (like GNU tar does), one that grows is cut at the scanned size.
+    """
+
+    def __init__(self, f: BinaryIO, size: int, path: str):
+        self._f = f
+        self._remaining = size
+        self._path = path
+        self._shrunk = False
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0 or n > self._remaining:
+            n = self._remaining
+        data = b'' if self._shrunk else self._f.read(n)
+        if len(data) < n:
+            if not self._shrunk:
+                logger.warning("%s: file shrank while being archived, padded with zeros", self._path)
+                self._shrunk = True
+            data += bytes(n - len(data))
+        self._remaining -= n
+        return data
+
+
+@lru_cache(maxsize=None)
+def _uname(uid: int) -> str:
+    try:
+        return pwd.getpwuid(uid).pw_name if pwd else ''
+    except KeyError:
+        return ''
+
+
+@lru_cache(maxsize=None)
+def _gname(gid: int) -> str:
+    try:
+        return grp.getgrgid(gid).gr_name if grp else ''
+    except KeyError:
+        return ''
+
+
+ARCHIVES = {TarArchive.FORMAT: TarArchive, ZipArchive.FORMAT: ZipArchive}
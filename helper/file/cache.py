@@ -0,0 +1,109 @@
+import logging
+import os
+import sqlite3
+import threading
+
+from pathlib import Path
+from typing import Dict, Iterable
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChecksumCache:
+    """
+    On-disk cache of file digests, keyed by (device, inode, size, mtime_ns, algorithm).
+    An entry is only returned while the file still has the same identity, size and modification time.
+    """
+    # name of the cache file in the backup directory
+    FILE_NAME = '.checksums.sqlite'
+    _SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS checksums (
+            device INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            algorithm TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            digest TEXT NOT NULL,
+            path TEXT NOT NULL,
+            PRIMARY KEY (device, inode, algorithm)
+        )
+    '''
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self._path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(self._SCHEMA)
+
+    def get(self, path: Path, algorithms: Iterable[str], stat: os.stat_result = None) -> Dict[str, str]:
+        stat = stat or path.stat()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT algorithm, digest FROM checksums WHERE device=? AND inode=? AND size=? AND mtime_ns=?',
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            ).fetchall()
+        algorithms = set(algorithms)
+        return {algorithm: digest for algorithm, digest in rows if algorithm in algorithms}
+
+    def put(self, path: Path, digests: Dict[str, str], stat: os.stat_result = None):
+        stat = stat or path.stat()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(stat.st_dev, stat.st_ino, algorithm, stat.st_size, stat.st_mtime_ns, str(digest), str(path))
+                 for algorithm, digest in digests.items()]
+            )
+
+    # remove entries of files that have been deleted or replaced since they were hashed
+    def evict_missing(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT DISTINCT device, inode, path FROM checksums').fetchall()
+            stale = list()
+            for device, inode, path in rows:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    stale.append((device, inode))
+                    continue
+                if (stat.st_dev, stat.st_ino) != (device, inode):
+                    stale.append((device, inode))
+            self._conn.executemany('DELETE FROM checksums WHERE device=? AND inode=?', stale)
+        if stale:
+            logger.debug("Evicted %d stale checksum cache entries", len(stale))
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        self.commit()
+        with self._lock:
+            self._conn.close()
+
+
+class InlineDigests:
+    """
+    Digests of backup artifacts that have been computed while the artifacts were written.
+    methods has to be set to the configured checksum methods before the backups are created.
+    """
+    methods: set = set()
+    _digests: dict = dict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, path: Path, digests: Dict[str, str]):
+        stat = path.stat()
+        with cls._lock:
+            cls._digests[(stat.st_dev, stat.st_ino)] = ((stat.st_size, stat.st_mtime_ns), digests)
+
+    # returns the recorded digests, as long as the file hasn't been changed since
+    @classmethod
+    def get(cls, path: Path, stat: os.stat_result = None) -> Dict[str, str]:
+        stat = stat or path.stat()
+        with cls._lock:
+            entry = cls._digests.get((stat.st_dev, stat.st_ino))
+        if not entry or entry[0] != (stat.st_size, stat.st_mtime_ns):
+            return dict()
+        return entry[1]
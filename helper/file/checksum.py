@@ -5,9 +5,11 @@ import hashlib
 import hmac
 
 from pathlib import Path
-from typing import Union, Generator
+from typing import Union, Generator, Iterable, Dict
 
+from .cache import ChecksumCache, InlineDigests
 from .filehandler import FileHandler, validate_path
+from .merkle import MerkleTree
 
 
 logger = logging.getLogger(__name__)
@@ -15,26 +17,74 @@ logger = logging.getLogger(__name__)
 
 class ChecksumLib:
     _DEFAULT_SHAKE_LENGTH = 32
+    _MMAP_THRESHOLD = 64 * 1024 * 1024
 
-    def __init__(self, length: int = 0):
+    def __init__(self, length: int = 0, cache: ChecksumCache = None, use_mmap: bool = False):
         self._shake_length = length if length else self._DEFAULT_SHAKE_LENGTH
-        self._file = FileHandler(chunk_size=2048)
+        self._file = FileHandler(mmap_threshold=self._MMAP_THRESHOLD if use_mmap else 0)
+        self._cache = cache
 
     @validate_path
     def get_checksum_file(self, path: Path, algorithm: str) -> Checksum:
-        gen = self._file.iter_read_file
+        gen = self._file.iter_read_view
         if algorithm not in Checksum.algorithms_available():
             logger.warning("Invalid checksum algorithm")
             return None
         return self._get_checksum(gen, algorithm, path)
 
     @validate_path
-    def get_checksum_dir(self, path: Path, algorithm: str) -> Checksum:
+    def get_checksums_file(self, path: Path, algorithms: Iterable[str]) -> Dict[str, Checksum]:
+        """Hash a file with several algorithms while reading it only once."""
+        algorithms = {a for a in algorithms if Checksum.is_available(a)}
+        if not algorithms:
+            logger.warning("Invalid checksum algorithm")
+            return None
+
+        stat = path.stat()
+        cached = self._cache.get(path, algorithms, stat) if self._cache else dict()
+        inline = {a: d for a, d in InlineDigests.get(path, stat).items() if a in algorithms and a not in cached}
+        if inline and self._cache:
+            self._cache.put(path, inline, stat)
+        cached.update(inline)
+        checksums = {a: StoredChecksum(a, bytes.fromhex(digest)) for a, digest in cached.items()}
+        missing = {a: Checksum.new(a, self._shake_length) for a in algorithms if a not in cached}
+        if not missing:
+            return checksums
+
+        for b in self._file.iter_read_view(path):
+            for c in missing.values():
+                c.update(b)
+        if self._cache:
+            self._cache.put(path, {a: c.to_str() for a, c in missing.items()}, stat)
+        checksums.update(missing)
+        return checksums
+
+    @validate_path
+    def get_fingerprint(self, path: Path) -> Checksum:
+        """Cheap checksum to decide whether a file has changed, see Fingerprint."""
+        checksums = self.get_checksums_file(path, [Fingerprint.NAME])
+        return checksums[Fingerprint.NAME] if checksums else None
+
+    @validate_path
+    def get_checksum_dir(self, path: Path, algorithm: str, merkle: bool = False, workers: int = 1,
+                         tree_path: Path = None) -> Checksum:
+        """
+        Without merkle all files are streamed into a single checksum (in rglob order).
+        With merkle the files are hashed independently by workers threads and combined per directory in sorted
+        order, the returned checksum is the root of the MerkleTree, which gets saved to tree_path if given.
+        """
         gen = self._file.iter_read_dir
         if algorithm not in Checksum.algorithms_available():
             logger.warning("Invalid checksum algorithm")
             return None
-        return self._get_checksum(gen, algorithm, path)
+        if not merkle:
+            return self._get_checksum(gen, algorithm, path)
+
+        tree = MerkleTree.build(path, algorithm, lambda f: self.get_checksums_file(f, [algorithm])[algorithm].to_str(),
+                                workers, self._shake_length)
+        if tree_path:
+            tree.save(tree_path)
+        return StoredChecksum(algorithm, bytes.fromhex(tree.root))
 
     def _get_checksum(self, gen: Generator[bytes], algorithm: str, path: Path):
         c = Checksum(algorithm, self._shake_length)
@@ -61,6 +111,14 @@ class Checksum:
     def algorithms_available() -> set:
         return hashlib.algorithms_available
 
+    @staticmethod
+    def is_available(algorithm: str) -> bool:
+        return algorithm in Checksum.algorithms_available() or algorithm == Fingerprint.NAME
+
+    @staticmethod
+    def new(algorithm: str, length: int = 0) -> Checksum:
+        return Fingerprint() if algorithm == Fingerprint.NAME else Checksum(algorithm, length)
+
     def update(self, data: bytes):
         self._hash.update(data)
 
@@ -80,8 +138,8 @@ class Checksum:
             return int(self) == checksum
         if isinstance(checksum, str):
             return str(self) == checksum
-        if isinstance(checksum, self.__class__):
-            if self.get_algorithm() is not checksum.get_algorithm():
+        if isinstance(checksum, Checksum):
+            if self.get_algorithm() != checksum.get_algorithm():
                 logger.warning("The compared checksum have different algorithms")
                 return False
             return hmac.compare_digest(bytes(self), bytes(checksum))
@@ -96,5 +154,41 @@ class Checksum:
     def __str__(self) -> str:
         return self.to_str()
 
+    def get_algorithm(self) -> str:
+        return self._algorithm
+
     def _get_args(self) -> list:
         return [self._shake_length] if self._algorithm in self._SHAKE else []
+
+
+class StoredChecksum(Checksum):
+    """Checksum of which only the final digest is known, e.g. because it has been read from a cache."""
+
+    def __init__(self, algorithm: str, digest: bytes):
+        super(StoredChecksum, self).__init__(algorithm)
+        self._algorithm = algorithm
+        self._digest = digest
+
+    def update(self, data: bytes):
+        raise TypeError("A stored checksum can't be updated")
+
+    def to_bytes(self) -> bytes:
+        return self._digest
+
+    def to_str(self) -> str:
+        return self._digest.hex()
+
+
+class Fingerprint(Checksum):
+    """
+    Fast keyed blake2b hash with a short digest. It is only used to detect changed files (e.g. to skip copies),
+    the configured checksum methods are still used for the published checksum files and the manifest.
+    """
+    NAME = 'fingerprint'
+    _DIGEST_SIZE = 16
+    _KEY = b'PyBackup fingerprint'
+
+    def __init__(self):
+        super(Fingerprint, self).__init__('blake2b')
+        self._algorithm = self.NAME
+        self._hash = hashlib.blake2b(digest_size=self._DIGEST_SIZE, key=self._KEY)
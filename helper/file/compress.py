@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import os
+import zlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Union
+
+
+# extensions of formats which are compressed already, compressing them again costs cpu for (almost) nothing
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.7z', '.aac', '.avi', '.bz2', '.docx', '.flac', '.gif', '.gz', '.heic', '.jpeg', '.jpg', '.lz4', '.m4a', '.m4v',
+    '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.opus', '.png', '.pptx', '.rar', '.tgz', '.webm', '.webp', '.xlsx', '.xz',
+    '.zip', '.zst'
+}
+_SAMPLE_SIZE = 64 * 1024
+# a sample has to shrink at least to this fraction of its size, otherwise the file is stored uncompressed
+_SAMPLE_RATIO = 0.95
+
+
+def is_compressible(path: Union[str, Path]) -> bool:
+    """classify a file by its extension, or by compressing a sample of its beginning with the fastest level"""
+    if Path(path).suffix.lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    with open(path, 'rb') as f:
+        sample = f.read(_SAMPLE_SIZE)
+    if len(sample) < 512:
+        return True
+    return len(zlib.compress(sample, 1)) < len(sample) * _SAMPLE_RATIO
+
+
+class ParallelGzipWriter:
+    """
+    Compresses the written data block wise with a pool of threads (zlib releases the GIL while compressing).
+    Every block becomes an independent gzip member, the members are written in order, so the output is a
+    standard multi-member gzip file which can be read by gzip, tar -xzf and the gzip module.
+    The underlying file object is not closed.
+    """
+    _DEFAULT_BLOCK_SIZE = 1024 * 1024
+    _DEFAULT_LEVEL = 6
+
+    def __init__(self, fileobj: BinaryIO, level: int = _DEFAULT_LEVEL, workers: int = 0, block_size: int = 0):
+        self._fileobj = fileobj
+        self._level = level
+        self._workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self._block_size = block_size if block_size else self._DEFAULT_BLOCK_SIZE
+        self._executor = ThreadPoolExecutor(max_workers=self._workers)
+        # blocks which are compressed but not written yet, bounded to keep the memory usage constant
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._size = 0
+        self.mode = 'wb'
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self._size += len(data)
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[:self._block_size])
+            del self._buffer[:self._block_size]
+            self._submit(block)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._buffer or not self._size:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._fileobj.write(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown()
+
+    def _submit(self, block: bytes):
+        self._pending.append(self._executor.submit(self._compress, block, self._level))
+        while len(self._pending) > self._workers * 2:
+            self._fileobj.write(self._pending.popleft().result())
+
+    @staticmethod
+    def _compress(block: bytes, level: int) -> bytes:
+        # wbits 31 creates a gzip member (header with mtime 0 and trailer) instead of a zlib stream
+        c = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return c.compress(block) + c.flush()
+
+    def __enter__(self) -> ParallelGzipWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    # stop without writing the remaining blocks, e.g. if the archive is incomplete anyway
+    def abort(self):
+        self.closed = True
+        self._executor.shutdown()
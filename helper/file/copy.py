@@ -0,0 +1,77 @@
+import errno
+import logging
+import os
+
+from typing import Union
+from pathlib import Path
+
+try:
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None
+
+
+logger = logging.getLogger(__name__)
+
+# _IOW(0x94, 9, int) from linux/fs.h, shares the extents of the source file (btrfs, XFS with reflink=1, ...)
+FICLONE = 0x40049409
+
+REFLINK = 'reflink'
+COPY_FILE_RANGE = 'copy_file_range'
+SENDFILE = 'sendfile'
+BUFFERED = 'buffered'
+
+_CHUNK_SIZE = 64 * 1024 * 1024
+# errors which mean the strategy is not supported for these files, so the next one should be tried
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF}
+
+
+def zero_copy(src: Union[str, Path], dst: Union[str, Path]) -> str:
+    """
+    Copy the content of src to dst without passing it through Python: reflink first, then copy_file_range
+    (in kernel copy) and sendfile. Returns the name of the strategy that has been used or None if none of them is
+    supported, dst is empty in that case.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(infd).st_size
+
+        if ioctl and _try(lambda: ioctl(outfd, FICLONE, infd)):
+            return REFLINK
+        if hasattr(os, 'copy_file_range') and _try(lambda: _copy_loop(os.copy_file_range, infd, outfd, size)):
+            return COPY_FILE_RANGE
+        if hasattr(os, 'sendfile') and _try(lambda: _copy_loop(_sendfile, infd, outfd, size)):
+            return SENDFILE
+    return None
+
+
+def _try(func) -> bool:
+    try:
+        func()
+        return True
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+        logger.debug("Copy strategy is not supported: %s", e)
+        return False
+
+
+def _copy_loop(func, infd: int, outfd: int, size: int):
+    offset = 0
+    while True:
+        try:
+            copied = func(infd, outfd, _CHUNK_SIZE)
+        except OSError as e:
+            # a strategy may only be replaced by the next one, as long as nothing has been copied yet
+            if offset and e.errno in _UNSUPPORTED:
+                raise OSError(errno.EIO, f"Copy failed after {offset} bytes: {e}") from e
+            raise
+        if not copied:
+            break
+        offset += copied
+    if offset < size:
+        raise OSError(errno.EIO, f"Copied only {offset} of {size} bytes")
+
+
+def _sendfile(infd: int, outfd: int, count: int) -> int:
+    return os.sendfile(outfd, infd, None, count)
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import zlib
+
+from pathlib import Path
+from stat import S_ISDIR, S_ISLNK, S_ISREG, S_IMODE
+from typing import BinaryIO, Generator, Iterable, List, Set, Tuple
+
+from .scanner import ScanEntry, TreeScanner
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkStore:
+    """
+    Content addressed store of deduplicated file chunks, located in <backup_dir>/.chunks.
+
+    Files are split into content defined chunks with a gear rolling hash (as in FastCDC): every byte shifts the
+    64 bit hash left and adds a pseudo random value of the byte, so the hash only depends on the last _WINDOW bytes
+    and a chunk ends where its _MASK bits are all zero (on average every 2**19 bytes, whatever the byte values are),
+    but not before _MIN_CHUNK and not after _MAX_CHUNK bytes. The first _MIN_CHUNK bytes of a chunk aren't hashed. Every unique chunk is stored once (zlib compressed, if that helps), named by its
+    sha256 digest. A backup of a source is a small json index which references the chunks of all files.
+    The chunks an index references are listed in the manifest of its date (as ../.chunks/<xx>/<digest>), so they're
+    checksummed and downloaded by the offsite backup together with the date.
+    Fifos, sockets and devices are skipped (and counted).
+    """
+    DIR_NAME = '.chunks'
+    INDEX_SUFFIX = '.index.json'
+    _MIN_CHUNK = 512 * 1024
+    _MAX_CHUNK = 4 * 1024 * 1024
+    _WINDOW = 64
+    _GEAR = tuple(int.from_bytes(hashlib.sha256(bytes([b])).digest()[:8], 'little') for b in range(256))
+    # the top bits of the hash, they depend on the most bytes of the window
+    _MASK = ((1 << 19) - 1) << (_WINDOW - 19)
+    _HASH_BITS = (1 << _WINDOW) - 1
+    _COMPRESSED = b'z'
+    _RAW = b'r'
+
+    def __init__(self, backup_dir: str, compression_level: int = 6):
+        self.backup_dir = Path(backup_dir)
+        self.path = self.backup_dir / self.DIR_NAME
+        self.compression_level = compression_level
+
+    def backup(self, src: str, index_path: Path, scanned: List[ScanEntry] = None) -> Tuple[int, int, int]:
+        """
+        store src (file or directory) and write its index, returns (bytes read, bytes newly stored, skipped entries)
+        scanned are the entries of an earlier TreeScanner run of src, src is scanned if they're not given
+        """
+        src = Path(src)
+        if scanned is None:
+            scanned = TreeScanner(src).scan()
+        entries, size, stored, skipped = list(), 0, 0, 0
+        for scan_entry in scanned:
+            path, stat = Path(scan_entry.path), scan_entry.stat
+            rel = f'{src.name}/{scan_entry.relpath}' if scan_entry.relpath else src.name
+            entry = {'path': rel, 'mode': S_IMODE(stat.st_mode), 'mtime_ns': stat.st_mtime_ns,
+                     'uid': stat.st_uid, 'gid': stat.st_gid}
+            if S_ISDIR(stat.st_mode):
+                entry['type'] = 'd'
+            elif S_ISLNK(stat.st_mode):
+                entry.update(type='l', target=os.readlink(path))
+            elif S_ISREG(stat.st_mode):
+                chunks = list()
+                with path.open('rb') as f:
+                    for chunk in self.iter_chunks(f):
+                        digest = hashlib.sha256(chunk).hexdigest()
+                        stored += self._put(digest, chunk)
+                        chunks.append(digest)
+                entry.update(type='f', size=stat.st_size, chunks=chunks)
+                size += stat.st_size
+            else:
+                logger.warning("Skipping %s, fifos, sockets and devices can't be deduplicated", path)
+                skipped += 1
+                continue
+            entries.append(entry)
+
+        index_path = Path(index_path)
+        tmp = index_path.with_name(index_path.name + '.tmp')
+        with tmp.open('w') as f:
+            json.dump({'version': 1, 'source': str(src), 'entries': entries}, f, separators=(',', ':'))
+        tmp.replace(index_path)
+        return size, stored, skipped
+
+    def restore(self, index_path: Path, target: Path):
+        """rebuild the files of an index below target"""
+        target = Path(target)
+        with Path(index_path).open('r') as f:
+            entries = json.load(f)['entries']
+
+        directories = list()
+        for entry in entries:
+            path = target / entry['path']
+            # existing links are replaced instead of followed, existing files are replaced by links
+            if path.is_symlink() or (entry['type'] == 'l' and path.is_file()):
+                path.unlink()
+            if entry['type'] == 'd':
+                path.mkdir(parents=True, exist_ok=True)
+                directories.append((path, entry))
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if entry['type'] == 'l':
+                os.symlink(entry['target'], path)
+                self._restore_owner(path, entry)
+                continue
+            with path.open('wb') as f:
+                for digest in entry['chunks']:
+                    f.write(self._get(digest))
+            self._restore_stat(path, entry)
+        # the directories are touched while their content is restored, so they get their times last
+        for path, entry in reversed(directories):
+            self._restore_stat(path, entry)
+
+    def collect_garbage(self) -> Tuple[int, int]:
+        """delete all chunks which are not referenced by any index, returns (number of chunks, bytes) removed"""
+        referenced = self.referenced(self.backup_dir.glob(f'*/*{self.INDEX_SUFFIX}'))
+
+        removed, freed = 0, 0
+        for chunk in self.path.glob('*/*'):
+            if chunk.name in referenced:
+                continue
+            freed += chunk.stat().st_size
+            chunk.unlink()
+            removed += 1
+        logger.info("Removed %d unreferenced chunks", removed)
+        return removed, freed
+
+    @staticmethod
+    def referenced(index_paths: Iterable[Path]) -> Set[str]:
+        """digests of all chunks the indexes reference"""
+        referenced = set()
+        for index_path in index_paths:
+            with Path(index_path).open('r') as f:
+                for entry in json.load(f)['entries']:
+                    referenced.update(entry.get('chunks', []))
+        return referenced
+
+    @classmethod
+    def chunk_path(cls, digest: str) -> str:
+        """path of a chunk relative to the backup dir"""
+        return f'{cls.DIR_NAME}/{digest[:2]}/{digest}'
+
+    @classmethod
+    def iter_chunks(cls, f: BinaryIO) -> Generator[bytes, None, None]:
+        buffer = b''
+        eof = False
+        while True:
+            if not eof and len(buffer) < cls._MAX_CHUNK:
+                data = f.read(cls._MAX_CHUNK)
+                eof = not data
+                buffer += data
+                continue
+            if not buffer:
+                return
+            end = cls._boundary(buffer)
+            yield buffer[:end]
+            buffer = buffer[end:]
+
+    @classmethod
+    def _boundary(cls, buffer: bytes) -> int:
+        """length of the chunk at the start of buffer"""
+        end = min(len(buffer), cls._MAX_CHUNK)
+        if end <= cls._MIN_CHUNK:
+            return end
+        gear, mask, bits, h = cls._GEAR, cls._MASK, cls._HASH_BITS, 0
+        # fill the window before the first possible boundary
+        for b in buffer[cls._MIN_CHUNK - cls._WINDOW:cls._MIN_CHUNK]:
+            h = ((h << 1) + gear[b]) & bits
+        for i, b in enumerate(buffer[cls._MIN_CHUNK:end], cls._MIN_CHUNK + 1):
+            h = ((h << 1) + gear[b]) & bits
+            if not h & mask:
+                return i
+        return end
+
+    def _put(self, digest: str, chunk: bytes) -> int:
+        path = self.backup_dir / self.chunk_path(digest)
+        if path.exists():
+            return 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = zlib.compress(chunk, self.compression_level)
+        data = self._COMPRESSED + data if len(data) < len(chunk) else self._RAW + chunk
+        # write to a temporary file first, so an interrupted run never leaves a truncated chunk behind
+        tmp = path.with_name(path.name + '.tmp')
+        tmp.write_bytes(data)
+        tmp.replace(path)
+        return len(data)
+
+    def _get(self, digest: str) -> bytes:
+        data = (self.backup_dir / self.chunk_path(digest)).read_bytes()
+        chunk = zlib.decompress(data[1:]) if data[:1] == self._COMPRESSED else data[1:]
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} is corrupted")
+        return chunk
+
+    @classmethod
+    def _restore_stat(cls, path: Path, entry: dict):
+        cls._restore_owner(path, entry)
+        os.chmod(path, entry['mode'])
+        os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+
+    # like tar, the owner is only restored by root, indexes of older versions don't have one
+    @staticmethod
+    def _restore_owner(path: Path, entry: dict):
+        if 'uid' not in entry or not hasattr(os, 'geteuid') or os.geteuid() != 0:
+            return
+        os.lchown(path, entry['uid'], entry['gid'])
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import logging
+import re
+
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from typing import List, Tuple, Union
+
+
+logger = logging.getLogger(__name__)
+
+# (relpath of the directory the pattern belongs to, pattern)
+Rule = Tuple[str, str]
+
+
+class PathFilter:
+    """
+    Include / exclude glob patterns and a maximum file size for the entries of a directory source.
+    Patterns follow a subset of the .gitignore rules: a pattern without a slash matches the name at any depth,
+    one with a slash matches the path relative to the source (or to the directory of the .backupignore file it's
+    read from), where * and ? don't match a slash and ** matches any number of directories. A trailing slash only
+    matches directories. Excluded directories are pruned, their content is never
+    scanned. Include patterns only apply to files: if there are any, a file has to match one of them.
+    """
+    IGNORE_FILE = '.backupignore'
+
+    def __init__(self, include: List[str] = None, exclude: List[str] = None, max_size: Union[int, str] = 0):
+        self.include: List[Rule] = [('', p) for p in include or list() if p]
+        self.exclude: List[Rule] = [('', p) for p in exclude or list() if p]
+        # files larger than max_size bytes are excluded, 0 means no limit
+        self.max_size = parse_size(max_size)
+
+    def rules(self, parent: List[Rule], relpath: str, ignore_file: str = None) -> List[Rule]:
+        """exclude rules of the directory relpath: those of its parent, extended by its .backupignore file"""
+        if not ignore_file:
+            return parent
+        return parent + [(relpath, p) for p in self.read_ignore_file(ignore_file)]
+
+    def excluded(self, rules: List[Rule], relpath: str, is_dir: bool) -> bool:
+        return any(self._match(base, pattern, relpath, is_dir) for base, pattern in rules)
+
+    def included(self, relpath: str) -> bool:
+        return not self.include or any(self._match(base, pattern, relpath, False) for base, pattern in self.include)
+
+    def too_large(self, size: int) -> bool:
+        return bool(self.max_size) and size > self.max_size
+
+    @staticmethod
+    def read_ignore_file(path: str) -> List[str]:
+        """patterns of an ignore file, empty lines and comments (#) are skipped"""
+        try:
+            with open(path, 'r') as f:
+                lines = [line.strip() for line in f]
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning("Unable to read '%s': %s", path, e)
+            return list()
+        return [line for line in lines if line and not line.startswith('#')]
+
+    @staticmethod
+    def _match(base: str, pattern: str, relpath: str, is_dir: bool) -> bool:
+        if pattern.endswith('/'):
+            if not is_dir:
+                return False
+            pattern = pattern.rstrip('/')
+        if '/' not in pattern:
+            return fnmatchcase(relpath.rsplit('/', 1)[-1], pattern)
+        if base:
+            if not relpath.startswith(base + '/'):
+                return False
+            relpath = relpath[len(base) + 1:]
+        return bool(_compile(pattern.lstrip('/')).match(relpath))
+
+    def __bool__(self) -> bool:
+        return bool(self.include or self.exclude or self.max_size)
+
+
+@lru_cache(maxsize=None)
+def _compile(pattern: str):
+    """regex of a pattern with a slash, like fnmatch.translate, but * ? and [] stay within a path segment"""
+    parts, i, n = list(), 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif c == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif c == '?':
+            parts.append('[^/]')
+            i += 1
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                parts.append(re.escape(c))
+                i += 1
+                continue
+            chars = pattern[i + 1:j].replace('\\', '\\\\')
+            if chars[0] in '!^':
+                chars = '^' + chars[1:]
+            parts.append(f'(?!/)[{chars}]')
+            i = j + 1
+        else:
+            parts.append(re.escape(c))
+            i += 1
+    return re.compile(''.join(parts) + r'\Z', re.DOTALL)
+
+
+def parse_size(size) -> int:
+    """bytes of a size like 1048576, '512K', '100M' or '2G'"""
+    if not size:
+        return 0
+    if isinstance(size, int):
+        return size
+    size = str(size).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
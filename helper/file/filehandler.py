@@ -1,4 +1,7 @@
+import io
 import logging
+import mmap
+import threading
 
 from pathlib import Path, WindowsPath, PosixPath
 from typing import Union, Generator
@@ -6,6 +9,9 @@ from typing import Union, Generator
 
 logger = logging.getLogger(__name__)
 
+# one free read buffer per thread, shared by all FileHandler instances used in that thread
+_buffers = threading.local()
+
 
 def validate_path(func):
     def wrapper(cls, path: Union[str, Path] = "", *args, **kwargs):
@@ -25,10 +31,25 @@ def validate_path(func):
 
 
 class FileHandler:
-    _DEFAULT_CHUNK_SIZE = 2048
+    """
+    chunk_size of 0 picks the chunk size from the file size and the block size of the filesystem.
+    Files of at least mmap_threshold bytes are mapped into memory by iter_read_view (0 disables mmap).
+    """
+    _MIN_CHUNK_SIZE = 64 * 1024
+    _MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, chunk_size: int = 0, mmap_threshold: int = 0):
+        self._chunk_size = chunk_size
+        self._mmap_threshold = mmap_threshold
 
-    def __init__(self, chunk_size: int = 0):
-        self._chunk_size = chunk_size if chunk_size else self._DEFAULT_CHUNK_SIZE
+    def get_chunk_size(self, path: Path) -> int:
+        if self._chunk_size:
+            return self._chunk_size
+        stat = path.stat()
+        block = getattr(stat, 'st_blksize', 0) or io.DEFAULT_BUFFER_SIZE
+        size = min(max(stat.st_size, self._MIN_CHUNK_SIZE), self._MAX_CHUNK_SIZE)
+        # round up to a multiple of the filesystem block size
+        return -(-size // block) * block
 
     @validate_path
     def iter_read_file(self, path: Path) -> Generator[bytes, None, None]:
@@ -36,10 +57,38 @@ class FileHandler:
             logger.warning("The specified path is not a file")
             return None
 
+        chunk_size = self.get_chunk_size(path)
         with path.open('rb') as f:
-            for chunk in iter(lambda: f.read(self._chunk_size), b''):
+            for chunk in iter(lambda: f.read(chunk_size), b''):
                 yield chunk
 
+    @validate_path
+    def iter_read_view(self, path: Path) -> Generator[memoryview, None, None]:
+        """
+        Like iter_read_file, but yields views into a reused buffer (or the memory map) instead of new bytes objects.
+        A view is only valid until the next one has been requested (it's released afterwards). The buffer of the
+        thread is taken by the generator while it runs, other generators of the same thread get their own buffer.
+        """
+        if not path.is_file():
+            logger.warning("The specified path is not a file")
+            return None
+
+        chunk_size = self.get_chunk_size(path)
+        with path.open('rb', buffering=0) as f:
+            size = path.stat().st_size
+            if self._mmap_threshold and size >= self._mmap_threshold:
+                yield from self._iter_mmap(f, size, chunk_size)
+                return
+
+            data = self._acquire_buffer(chunk_size)
+            try:
+                with memoryview(data)[:chunk_size] as buffer:
+                    for n in iter(lambda: f.readinto(buffer), 0):
+                        with buffer[:n] as chunk:
+                            yield chunk
+            finally:
+                self._release_buffer(data)
+
     @validate_path
     def iter_read_dir(self, path: Path, pattern: str = '*') -> Generator[bytes, None, None]:
         if not path.is_dir():
@@ -50,3 +99,26 @@ class FileHandler:
             if not file.is_file():
                 continue
             yield from self.iter_read_file(file)
+
+    @staticmethod
+    def _iter_mmap(f, size: int, chunk_size: int) -> Generator[memoryview, None, None]:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, memoryview(m) as view:
+            if hasattr(m, 'madvise'):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            for offset in range(0, size, chunk_size):
+                with view[offset:offset + chunk_size] as chunk:
+                    yield chunk
+
+    @staticmethod
+    def _acquire_buffer(size: int) -> bytearray:
+        buffer = getattr(_buffers, 'free', None)
+        _buffers.free = None
+        if buffer is None or len(buffer) < size:
+            buffer = bytearray(size)
+        return buffer
+
+    @staticmethod
+    def _release_buffer(buffer: bytearray):
+        free = getattr(_buffers, 'free', None)
+        if free is None or len(free) < len(buffer):
+            _buffers.free = buffer
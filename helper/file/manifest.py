@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import json
+import logging
+
+from pathlib import Path
+from typing import Dict, Generator, Iterable
+
+
+logger = logging.getLogger(__name__)
+
+
+class Manifest:
+    """
+    Machine readable checksum manifest of a backup date.
+
+    The first line is a json header, every following line is a json object describing one file
+    (path relative to the backup date, size, mtime_ns and the digests of every checksum method). The chunks of
+    deduplicated backups are stored next to the date folders, their paths start with ../.chunks/.
+    Entries are sorted by path, so a single entry can be looked up by a binary search over the file
+    without parsing the whole manifest.
+    """
+    FILE_NAME = 'manifest.jsonl'
+    VERSION = 1
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    @staticmethod
+    def entry(path: str, size: int, mtime_ns: int, digests: Dict[str, str]) -> dict:
+        return {'path': path, 'size': size, 'mtime_ns': mtime_ns, 'digests': digests}
+
+    def write(self, entries: Iterable[dict], **header):
+        header = dict(header, version=self.VERSION)
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with tmp.open('w') as f:
+            f.write(self._dumps(header))
+            for entry in sorted(entries, key=lambda e: e['path']):
+                f.write(self._dumps(entry))
+        # replace the manifest atomically, so readers never see a partially written file
+        tmp.replace(self.path)
+
+    def header(self) -> dict:
+        with self.path.open('rb') as f:
+            return json.loads(f.readline())
+
+    def lookup(self, path: str) -> dict:
+        with self.path.open('rb') as f:
+            f.readline()
+            lo = f.tell()
+            f.seek(0, 2)
+            hi = f.tell()
+            # invariant: if the entry exists, its line starts within [lo, hi)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                # move to the start of the first line at or after mid
+                f.seek(mid - 1)
+                f.readline()
+                start = f.tell()
+                if start >= hi:
+                    hi = mid
+                    continue
+                entry = json.loads(f.readline())
+                if entry['path'] == path:
+                    return entry
+                if entry['path'] < path:
+                    lo = f.tell()
+                else:
+                    hi = start
+        return None
+
+    def __iter__(self) -> Generator[dict, None, None]:
+        with self.path.open('rb') as f:
+            f.readline()
+            for line in f:
+                yield json.loads(line)
+
+    def __contains__(self, path: str) -> bool:
+        return self.lookup(path) is not None
+
+    @staticmethod
+    def _dumps(obj: dict) -> str:
+        return json.dumps(obj, separators=(',', ':')) + '\n'
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List
+
+
+logger = logging.getLogger(__name__)
+
+
+class MerkleTree:
+    """
+    Merkle tree of a directory. Every node is addressed by its path relative to the root ('' is the root itself)
+    and is stored as [type, digest], where type is 'f' for files and 'd' for directories.
+    The digest of a file is the plain checksum of its content, the digest of a directory is the checksum over
+    type, name and digest of all children in sorted order, so an empty directory (or tree) has the digest of no
+    input. Two trees can be compared by descending into differing subtrees only.
+    """
+    FILE = 'f'
+    DIR = 'd'
+    FILE_NAME = 'merkle.json'
+    _SHAKE = {'shake_128', 'shake_256'}
+    _DEFAULT_SHAKE_LENGTH = 32
+
+    def __init__(self, algorithm: str, nodes: Dict[str, list] = None, length: int = 0):
+        self.algorithm = algorithm
+        # digest length of shake algorithms
+        self.length = length or self._DEFAULT_SHAKE_LENGTH
+        self.nodes: Dict[str, list] = nodes or dict()
+        self._children: Dict[str, List[str]] = None
+
+    @classmethod
+    def build(cls, path: Path, algorithm: str, hash_file: Callable[[Path], str], workers: int = 1,
+              length: int = 0) -> MerkleTree:
+        """hash_file has to return the hex digest of a file, the files are hashed concurrently by workers threads"""
+        path = Path(path)
+        dirs, files = cls._scan(path)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            digests = dict(zip(files, executor.map(lambda f: hash_file(path / f), files)))
+        return cls.from_digests(algorithm, digests, dirs, length)
+
+    @classmethod
+    def from_digests(cls, algorithm: str, digests: Dict[str, str], dirs: List[str] = (),
+                     length: int = 0) -> MerkleTree:
+        """create the tree from already known file digests (relative posix path -> hex digest)"""
+        tree = cls(algorithm, length=length)
+        tree.nodes[''] = [cls.DIR, None]
+        for file, digest in digests.items():
+            tree.nodes[file] = [cls.FILE, digest]
+        for directory in dirs:
+            tree.nodes[directory] = [cls.DIR, None]
+        # make sure every parent directory exists
+        for node in list(tree.nodes):
+            while node:
+                node = cls._parent(node)
+                tree.nodes.setdefault(node, [cls.DIR, None])
+
+        # the deepest directories are hashed first, so all children are known when a directory gets hashed
+        children = tree.children()
+        for directory in sorted((n for n, (t, _) in tree.nodes.items() if t == cls.DIR),
+                                key=lambda n: n.count('/') + bool(n), reverse=True):
+            h = hashlib.new(algorithm)
+            for child in children.get(directory, []):
+                node_type, digest = tree.nodes[child]
+                h.update(node_type.encode() + cls._name(child).encode('utf-8', 'surrogateescape') + b'\0')
+                h.update(bytes.fromhex(digest))
+            tree.nodes[directory][1] = h.hexdigest(tree.length) if algorithm in cls._SHAKE else h.hexdigest()
+        return tree
+
+    @property
+    def root(self) -> str:
+        return self.nodes[''][1] if '' in self.nodes else None
+
+    def children(self) -> Dict[str, List[str]]:
+        if self._children is None:
+            self._children = dict()
+            for node in sorted(self.nodes):
+                if node:
+                    self._children.setdefault(self._parent(node), list()).append(node)
+        return self._children
+
+    def diff(self, other: MerkleTree, node: str = '') -> List[str]:
+        """
+        paths of all files which are different, new or missing in other
+        only subtrees with a different digest are visited
+        """
+        if self.algorithm != other.algorithm or self.length != other.length:
+            raise ValueError("The compared trees have different algorithms")
+        mine, theirs = self.nodes.get(node), other.nodes.get(node)
+        if mine == theirs:
+            return []
+        mine_dir = mine is not None and mine[0] == self.DIR
+        theirs_dir = theirs is not None and theirs[0] == self.DIR
+        if mine_dir and theirs_dir:
+            children = set(self.children().get(node, [])) | set(other.children().get(node, []))
+            return [changed for child in sorted(children) for changed in self.diff(other, child)]
+
+        # a file changed, or a node only exists in / has a different type in one of the trees
+        changed = set()
+        for tree, entry in ((self, mine), (other, theirs)):
+            if entry is not None:
+                changed.update(self._files(node, tree))
+        return sorted(changed)
+
+    def save(self, path: Path):
+        path = Path(path)
+        tmp = path.with_name(path.name + '.tmp')
+        with tmp.open('w') as f:
+            json.dump({'algorithm': self.algorithm, 'length': self.length, 'nodes': self.nodes}, f,
+                      separators=(',', ':'))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> MerkleTree:
+        with Path(path).open('r') as f:
+            data = json.load(f)
+        return cls(data['algorithm'], data['nodes'], data.get('length', 0))
+
+    @classmethod
+    def _files(cls, node: str, tree: MerkleTree) -> List[str]:
+        if tree.nodes[node][0] == cls.FILE:
+            return [node]
+        return [f for child in tree.children().get(node, []) for f in cls._files(child, tree)]
+
+    @staticmethod
+    def _scan(path: Path) -> (List[str], List[str]):
+        dirs, files = list(), list()
+        for root, dirnames, filenames in os.walk(path):
+            rel = Path(root).relative_to(path).as_posix()
+            prefix = '' if rel == '.' else rel + '/'
+            dirs.extend(prefix + d for d in dirnames if not os.path.islink(os.path.join(root, d)))
+            files.extend(prefix + f for f in filenames if os.path.isfile(os.path.join(root, f))
+                         and not os.path.islink(os.path.join(root, f)))
+        return dirs, files
+
+    @staticmethod
+    def _parent(node: str) -> str:
+        return node.rpartition('/')[0]
+
+    @staticmethod
+    def _name(node: str) -> str:
+        return node.rpartition('/')[2]
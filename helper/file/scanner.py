@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import os
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from stat import S_ISDIR, S_ISLNK, S_ISREG
+from typing import List, NamedTuple, Tuple, Union
+
+from .exclude import PathFilter, Rule
+
+
+class ScanEntry(NamedTuple):
+    path: str
+    # path relative to the scanned root in posix notation, '' for the root itself
+    relpath: str
+    stat: os.stat_result
+
+    def is_dir(self) -> bool:
+        return S_ISDIR(self.stat.st_mode)
+
+    def is_file(self) -> bool:
+        return S_ISREG(self.stat.st_mode)
+
+    def is_symlink(self) -> bool:
+        return S_ISLNK(self.stat.st_mode)
+
+
+class TreeScanner:
+    """
+    Walks a directory tree once with os.scandir and keeps the (lstat) result of every entry, so size accounting,
+    archiving and checksum generation don't have to stat the same files again. Subdirectories are scanned by a pool
+    of threads, which pays off on network filesystems (NFS, CIFS) where every stat is a round trip.
+    Symlinks are never followed. With a path_filter, excluded entries are left out and counted, excluded directories
+    are pruned without scanning their content.
+    """
+
+    def __init__(self, root: Union[str, Path], workers: int = 1, path_filter: PathFilter = None):
+        self.root = str(root)
+        self.workers = max(1, workers)
+        self.path_filter = path_filter
+        self.excluded_files = 0
+        self.excluded_bytes = 0
+        self.pruned_dirs = 0
+        self._entries: List[ScanEntry] = None
+
+    def scan(self) -> List[ScanEntry]:
+        """all entries including the root, sorted by relpath (so directories come before their content)"""
+        if self._entries is not None:
+            return self._entries
+
+        root = ScanEntry(self.root, '', os.lstat(self.root))
+        entries = [root]
+        if root.is_dir():
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                rules = self.path_filter.exclude if self.path_filter else list()
+                pending = {executor.submit(self._scan_dir, self.root, '', rules)}
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        found, rules, excluded = future.result()
+                        entries.extend(found)
+                        self.excluded_files += excluded[0]
+                        self.excluded_bytes += excluded[1]
+                        self.pruned_dirs += excluded[2]
+                        pending |= {executor.submit(self._scan_dir, e.path, e.relpath, rules)
+                                    for e in found if e.is_dir()}
+
+        entries.sort(key=lambda e: e.relpath.split('/'))
+        self._entries = entries
+        return entries
+
+    def size(self) -> int:
+        """size of all regular files"""
+        return sum(e.stat.st_size for e in self.scan() if e.is_file())
+
+    def files(self) -> List[ScanEntry]:
+        return [e for e in self.scan() if e.is_file()]
+
+    def excluded(self) -> bool:
+        return bool(self.excluded_files or self.pruned_dirs)
+
+    # entries of the directory path, the exclude rules of its subdirectories and the excluded (files, bytes, dirs)
+    def _scan_dir(self, path: str, relpath: str, rules: List[Rule]) -> Tuple[List[ScanEntry], List[Rule], tuple]:
+        prefix = relpath + '/' if relpath else ''
+        path_filter = self.path_filter
+        with os.scandir(path) as it:
+            dir_entries = list(it)
+        if path_filter is not None:
+            ignore_file = next((e.path for e in dir_entries if e.name == PathFilter.IGNORE_FILE), None)
+            rules = path_filter.rules(rules, relpath, ignore_file)
+
+        entries, files, size, dirs = list(), 0, 0, 0
+        for e in dir_entries:
+            rel = prefix + e.name
+            try:
+                # the type comes from the directory listing, so pruned directories are never stat-ed
+                if rules and path_filter.excluded(rules, rel, e.is_dir(follow_symlinks=False)):
+                    if e.is_dir(follow_symlinks=False):
+                        dirs += 1
+                    else:
+                        files, size = files + 1, size + e.stat(follow_symlinks=False).st_size
+                    continue
+                stat = e.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                # removed while scanning
+                continue
+            if path_filter is not None and S_ISREG(stat.st_mode) and \
+                    (path_filter.too_large(stat.st_size) or not path_filter.included(rel)):
+                files, size = files + 1, size + stat.st_size
+                continue
+            entries.append(ScanEntry(e.path, rel, stat))
+        return entries, rules, (files, size, dirs)
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+from .scanner import ScanEntry, TreeScanner
+
+
+class Snapshot:
+    """
+    State of a directory source for incremental and differential archives (similar to GNU tar's listed-incremental).
+    entries map the path relative to the source to [type, size, mtime_ns, inode, mode, uid, gid, ctime_ns], type is
+    'd' for directories and 'f' for everything else (ctime also catches changes which keep mtime, like touch -m or
+    an unpacked archive). full holds the entries of the last full archive, last those of the last archive.
+    """
+    FULL = 'full'
+    INCREMENTAL = 'incremental'
+    DIFFERENTIAL = 'differential'
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.full_date: str = None
+        self.last_date: str = None
+        self.full: Dict[str, list] = dict()
+        self.last: Dict[str, list] = dict()
+
+    @staticmethod
+    def state_path(state_dir: Path, src: str) -> Path:
+        """state file of a source, keyed by its absolute path since sources may share a basename"""
+        digest = hashlib.sha256(os.path.abspath(src).encode()).hexdigest()[:16]
+        return Path(state_dir) / f'{os.path.basename(os.path.normpath(src))}.{digest}.json'
+
+    @classmethod
+    def load(cls, path: Path) -> Snapshot:
+        snapshot = cls(path)
+        if snapshot.path.is_file():
+            with snapshot.path.open('r') as f:
+                data = json.load(f)
+            snapshot.full_date = data.get('full_date')
+            snapshot.last_date = data.get('last_date')
+            snapshot.full = data.get('full') or dict()
+            snapshot.last = data.get('last') or dict()
+        return snapshot
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with tmp.open('w') as f:
+            json.dump({'full_date': self.full_date, 'last_date': self.last_date, 'full': self.full, 'last': self.last},
+                      f, separators=(',', ':'))
+        tmp.replace(self.path)
+
+    def level(self, mode: str, today: str, full_interval: int) -> str:
+        """the kind of archive that has to be created today"""
+        if mode not in (self.INCREMENTAL, self.DIFFERENTIAL) or not self.full_date or not self.last_date:
+            return self.FULL
+        # the state of today has already been recorded, but the archive is gone: start a new chain
+        if self.last_date >= today:
+            return self.FULL
+        if full_interval and (date.fromisoformat(today) - date.fromisoformat(self.full_date)).days >= full_interval:
+            return self.FULL
+        return mode
+
+    def base(self, level: str) -> Tuple[str, Dict[str, list]]:
+        """date and entries the archive of the given level is based on"""
+        if level == self.INCREMENTAL:
+            return self.last_date, self.last
+        if level == self.DIFFERENTIAL:
+            return self.full_date, self.full
+        return None, dict()
+
+    def update(self, level: str, today: str, entries: Dict[str, list]):
+        if level == self.FULL:
+            self.full_date, self.full = today, entries
+        self.last_date, self.last = today, entries
+
+    @staticmethod
+    def scan(src: Path, workers: int = 1) -> Dict[str, list]:
+        return Snapshot.entries(TreeScanner(src, workers).scan())
+
+    @staticmethod
+    def entries(scanned: Iterable[ScanEntry]) -> Dict[str, list]:
+        """entries of the result of a TreeScanner, without the source itself"""
+        entries = dict()
+        for entry in scanned:
+            if not entry.relpath:
+                continue
+            kind = 'd' if entry.is_dir() else 'f'
+            stat = entry.stat
+            entries[entry.relpath] = [kind, stat.st_size if kind == 'f' else 0, stat.st_mtime_ns, stat.st_ino,
+                                      stat.st_mode, stat.st_uid, stat.st_gid, stat.st_ctime_ns]
+        return entries
+
+    @staticmethod
+    def changes(current: Dict[str, list], base: Dict[str, list]) -> Tuple[List[str], List[str]]:
+        """new or modified paths and deleted paths (sorted) of current compared to base"""
+        changed = sorted(path for path, entry in current.items() if base.get(path) != entry)
+        deleted = sorted(path for path in base if path not in current)
+        return changed, deleted
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+
+from pathlib import Path
+from typing import BinaryIO, List, Union
+
+from .exclude import parse_size
+from .writer import HashingWriter
+
+
+logger = logging.getLogger(__name__)
+
+
+class VolumeWriter:
+    """
+    Splits a stream into numbered volumes <path>.001, <path>.002, ... of volume_size bytes, every volume is written
+    by a HashingWriter (so it's checksummed on its own). The set is complete once <path>.volumes.json, which lists
+    the volumes, has been written; cat <path>.0* restores the original stream.
+    A volume is only renamed to its final name once it's complete. If an earlier run has been interrupted, the
+    volumes it completed are compared with the new stream while it's written and kept if they're equal (the
+    archives are deterministic as long as the source didn't change), only differing volumes are written again.
+    """
+    INDEX_SUFFIX = '.volumes.json'
+    _DIGITS = 3
+
+    def __init__(self, path: Union[str, Path], volume_size: Union[int, str]):
+        self.path = Path(path)
+        self.volume_size = parse_size(volume_size)
+        if self.volume_size <= 0:
+            raise ValueError('volume_size has to be positive')
+        self.name = str(self.path)
+        self.mode = 'wb'
+        self.closed = False
+        self.volumes: List[Path] = list()
+        self.reused = 0
+        self._size = 0
+        # bytes of the current volume and where they go: an earlier volume they're compared with or a new one
+        self._offset = 0
+        self._existing: BinaryIO = None
+        self._out: HashingWriter = None
+
+    @classmethod
+    def is_complete(cls, path: Union[str, Path]) -> bool:
+        return Path(f'{path}{cls.INDEX_SUFFIX}').is_file()
+
+    @classmethod
+    def files(cls, path: Union[str, Path]) -> List[Path]:
+        """the volumes and the index of a complete set"""
+        index = Path(f'{path}{cls.INDEX_SUFFIX}')
+        with index.open('rb') as f:
+            volumes = json.load(f)['volumes']
+        return [index.with_name(volume) for volume in volumes] + [index]
+
+    def write(self, data: bytes) -> int:
+        view = memoryview(data)
+        while view:
+            if not self._existing and not self._out:
+                self._next_volume()
+            n = min(len(view), self.volume_size - self._offset)
+            self._write(view[:n])
+            self._offset += n
+            self._size += n
+            view = view[n:]
+            if self._offset == self.volume_size:
+                self._finish_volume()
+        return len(data)
+
+    def tell(self) -> int:
+        return self._size
+
+    def flush(self):
+        if self._out:
+            self._out.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        if self._existing or self._out or not self.volumes:
+            # the last (or only, if nothing has been written) volume is smaller
+            if not self._existing and not self._out:
+                self._next_volume()
+            self._finish_volume()
+        self.closed = True
+
+        # volumes of an earlier, longer stream
+        index = len(self.volumes) + 1
+        while self._volume_path(index).exists():
+            self._volume_path(index).unlink()
+            index += 1
+
+        index_path = Path(f'{self.path}{self.INDEX_SUFFIX}')
+        tmp = index_path.with_name(index_path.name + '.tmp')
+        with HashingWriter.open(tmp) as f:
+            f.write(json.dumps({
+                'volumes': [v.name for v in self.volumes],
+                'volume_size': self.volume_size,
+                'size': self._size
+            }).encode())
+        tmp.replace(index_path)
+        if self.reused:
+            logger.info("%s: reused %d of %d volumes", self.path, self.reused, len(self.volumes))
+
+    def abort(self):
+        """stop without completing the set, the completed volumes are kept for the next run"""
+        self.closed = True
+        if self._existing:
+            self._existing.close()
+        if self._out:
+            self._out.close(record=False)
+            self._tmp_path(len(self.volumes)).unlink()
+
+    def _next_volume(self):
+        self.volumes.append(self._volume_path(len(self.volumes) + 1))
+        self._offset = 0
+        if self.volumes[-1].is_file():
+            self._existing = self.volumes[-1].open('rb')
+        else:
+            self._out = HashingWriter.open(self._tmp_path(len(self.volumes)))
+
+    def _write(self, data: memoryview):
+        if self._existing:
+            if self._existing.read(len(data)) == data:
+                return
+            self._rewrite()
+        self._out.write(data)
+
+    # the volume of the earlier run differs, it's written again starting with the part that has been equal
+    def _rewrite(self):
+        self._out = HashingWriter.open(self._tmp_path(len(self.volumes)))
+        self._existing.seek(0)
+        remaining = self._offset
+        while remaining:
+            data = self._existing.read(min(remaining, 1024 * 1024))
+            self._out.write(data)
+            remaining -= len(data)
+        self._existing.close()
+        self._existing = None
+
+    def _finish_volume(self):
+        if self._existing:
+            if self._existing.read(1):
+                # the volume of the earlier run is longer
+                self._rewrite()
+            else:
+                self._existing.close()
+                self._existing = None
+                self.reused += 1
+                return
+        self._out.close()
+        self._out = None
+        os.replace(self._tmp_path(len(self.volumes)), self.volumes[-1])
+
+    def _volume_path(self, index: int) -> Path:
+        return self.path.with_name(f'{self.path.name}.{index:0{self._DIGITS}d}')
+
+    def _tmp_path(self, index: int) -> Path:
+        path = self._volume_path(index)
+        return path.with_name(path.name + '.tmp')
+
+    def __enter__(self) -> VolumeWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def open_writer(path: Union[str, Path], volume_size: Union[int, str] = 0) -> Union[HashingWriter, VolumeWriter]:
+    """a VolumeWriter if volume_size is set, otherwise a HashingWriter for path"""
+    if parse_size(volume_size):
+        return VolumeWriter(path, volume_size)
+    return HashingWriter.open(path)
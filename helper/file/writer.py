@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from pathlib import Path
+from shutil import copystat
+from typing import BinaryIO, Dict, Iterable, Union
+
+from .cache import InlineDigests
+from .checksum import Checksum, Fingerprint
+
+
+class HashingWriter:
+    """
+    Writes to the underlying file and updates a checksum for every given algorithm (and the fingerprint)
+    with the written bytes. If the writer has been created with open(), the digests are recorded in InlineDigests
+    once it has been closed without an error. If stat_from is given, its permissions and timestamps are copied
+    to the written file before.
+    """
+
+    def __init__(self, fileobj: BinaryIO, algorithms: Iterable[str] = None, path: Path = None,
+                 stat_from: Union[str, Path] = None):
+        self._fileobj = fileobj
+        algorithms = set(InlineDigests.methods if algorithms is None else algorithms) | {Fingerprint.NAME}
+        self._checksums = {a: Checksum.new(a) for a in algorithms if Checksum.is_available(a)}
+        self._path = path
+        self._stat_from = stat_from
+        self._size = 0
+        self.name = str(path) if path else getattr(fileobj, 'name', '')
+        self.mode = 'wb'
+        self.closed = False
+
+    @classmethod
+    def open(cls, path: Union[str, Path], algorithms: Iterable[str] = None,
+             stat_from: Union[str, Path] = None) -> HashingWriter:
+        path = Path(path)
+        return cls(path.open('wb'), algorithms, path, stat_from)
+
+    def write(self, data: bytes) -> int:
+        for c in self._checksums.values():
+            c.update(data)
+        self._fileobj.write(data)
+        self._size += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._size
+
+    def flush(self):
+        self._fileobj.flush()
+
+    def get_checksums(self) -> Dict[str, Checksum]:
+        return self._checksums
+
+    def close(self, record: bool = True):
+        if self.closed:
+            return
+        self.closed = True
+        self._fileobj.close()
+        if record and self._path and self._stat_from:
+            copystat(self._stat_from, self._path)
+        if record and self._path and self._checksums:
+            InlineDigests.record(self._path, {a: c.to_str() for a, c in self._checksums.items()})
+
+    def __enter__(self) -> HashingWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(record=exc_type is None)
@@ -1,73 +1,271 @@
 from datetime import datetime
-from shutil import copyfile
+from pathlib import Path
+from shutil import copyfileobj, copystat
 from colorama import Fore
-from tarfile import is_tarfile, open as tar_open
+from time import time
+import json
 import os
 
 from . import Printer, FileResult, sizeof, convert_size
+from .file.cache import ChecksumCache
+from .file.checksum import ChecksumLib
+from .file.archive import ARCHIVES, TarArchive
+from .file.copy import BUFFERED, zero_copy
+from .file.dedup import ChunkStore
+from .file.exclude import PathFilter
+from .file.scanner import TreeScanner
+from .file.snapshot import Snapshot
+from .file.volume import VolumeWriter, open_writer
+from .file.writer import HashingWriter
 
 
 class File:
-    def __init__(self, src: str = '', path: str = '/home/backups'):
+    _COPY_BUFSIZE = 1024 * 1024
+    _LEVEL_SUFFIXES = {
+        Snapshot.FULL: '',
+        Snapshot.INCREMENTAL: '.incr',
+        Snapshot.DIFFERENTIAL: '.diff'
+    }
+    # member of incremental / differential archives which lists the base and the deleted paths
+    CHANGES_MEMBER = '.pybackup-changes.json'
+
+    def __init__(self, src: str = '', path: str = '/home/backups', workers: int = 0, compression_level: int = 6,
+                 mode: str = Snapshot.FULL, full_interval: int = 7, storage: str = 'archive', cache: bool = True,
+                 archive_format: str = TarArchive.FORMAT, scan_workers: int = 4, include: list = None,
+                 exclude: list = None, max_file_size: int = 0, volume_size: int = 0):
         self.src = src
+        # tar.gz compresses the whole archive, zip compresses every entry on its own (and skips incompressible ones)
+        self.archive = ARCHIVES.get(archive_format, TarArchive)
+        # archive: tar.gz archives and plain copies, dedup: deduplicated chunks in the ChunkStore
+        self.storage = storage
+        # number of threads that compress archives, 0 uses all cpus
+        self.workers = workers
+        self.compression_level = compression_level
+        # full, incremental or differential directory archives, a new full archive is created every full_interval days
+        self.mode = mode
+        self.full_interval = full_interval
+        # number of threads that scan directory sources, more than one helps on network filesystems
+        self.scan_workers = scan_workers
+        # patterns (and .backupignore files) and the size limit for the content of directory sources
+        self.path_filter = PathFilter(include, exclude, max_file_size)
+        # directory archives are split into volumes of this size (bytes or K/M/G/T), 0 writes a single file
+        self.volume_size = volume_size
 
         # path where the backup should be stored
-        date = datetime.now().strftime("%Y-%m-%d")
+        self.date = datetime.now().strftime("%Y-%m-%d")
         if path.endswith("/"):
             path = path[:-1]
-        self.path: str = f'{path}/{date}/'
+        self.backup_dir: str = path
+        self.path: str = f'{path}/{self.date}/'
+        # fingerprints are cached in the checksum cache, so unchanged files are only read once
+        self.cache_path: Path = Path(path) / ChecksumCache.FILE_NAME if cache else None
         if not os.path.isdir(self.path):
             os.mkdir(self.path)
 
     def backup(self):
+        if self.storage == 'dedup' and os.path.exists(self.src):
+            return self.dedup_backup()
         if os.path.isdir(self.src):
             self.dir_backup()
         if os.path.isfile(self.src):
             self.file_backup()
 
-    # create tar.gz file of src
-    def dir_backup(self):
+    # store the chunks of src in the chunk store and write the index of today
+    def dedup_backup(self):
         src_basename = os.path.basename(self.src)
-        dest = f'{self.path}{src_basename}.tar.gz'
-        if os.path.isfile(dest) and is_tarfile(dest):
+        dest = f'{self.path}{src_basename}{ChunkStore.INDEX_SUFFIX}'
+        if os.path.isfile(dest):
             Printer.print(f'{Fore.YELLOW}{dest} already exist. Skipping!{Fore.RESET}')
-            return FileResult.data.append([
+            return FileResult.add([
                 self.src,
                 " ",
                 " ",
+                " ",
+                " ",
                 f'{Fore.YELLOW}Skipped{Fore.RESET}'
             ])
-        Printer.print(f'{Fore.YELLOW}Archiving {self.src} to {dest}.{Fore.RESET}')
-        with tar_open(dest, "w:gz") as target_fd:
-            target_fd.add(self.src, arcname=src_basename)
-        return FileResult.data.append([
+        Printer.print(f'{Fore.YELLOW}Deduplicating {self.src} to {dest}.{Fore.RESET}')
+        scanner = TreeScanner(self.src, self.scan_workers, self.path_filter)
+        store = ChunkStore(self.backup_dir, self.compression_level)
+        size, stored, skipped = store.backup(self.src, Path(dest), scanner.scan())
+        return FileResult.add([
             self.src,
-            sizeof(self.src),
-            convert_size(os.path.getsize(dest)) + ' (compressed)',
+            convert_size(size),
+            convert_size(stored) + ' (new chunks)',
+            self._excluded(scanner, skipped),
+            'dedup',
+            f'{Fore.GREEN}OK{Fore.RESET}'
+        ])
+
+    # create an archive of src, or only of the changes since the last (incremental) or full (differential) archive
+    def dir_backup(self):
+        src_basename = os.path.basename(self.src)
+        for archive in ARCHIVES.values():
+            for suffix in self._LEVEL_SUFFIXES.values():
+                dest = f'{self.path}{src_basename}{suffix}{archive.SUFFIX}'
+                if archive.is_archive(dest) or VolumeWriter.is_complete(dest):
+                    Printer.print(f'{Fore.YELLOW}{dest} already exist. Skipping!{Fore.RESET}')
+                    return FileResult.add([
+                        self.src,
+                        " ",
+                        " ",
+                        " ",
+                        " ",
+                        f'{Fore.YELLOW}Skipped{Fore.RESET}'
+                    ])
+
+        # the source is walked once, size, state and archive headers all use the stat results of this scan
+        scanner = TreeScanner(self.src, self.scan_workers, self.path_filter)
+        scanned = scanner.scan()
+        snapshot, level, entries = None, Snapshot.FULL, None
+        if self.mode != Snapshot.FULL:
+            snapshot = Snapshot.load(Snapshot.state_path(Path(self.backup_dir) / '.state', self.src))
+            level = snapshot.level(self.mode, self.date, self.full_interval)
+            entries = Snapshot.entries(scanned)
+
+        dest = f'{self.path}{src_basename}{self._LEVEL_SUFFIXES[level]}{self.archive.SUFFIX}'
+        Printer.print(f'{Fore.YELLOW}Archiving {self.src} to {dest} ({level}).{Fore.RESET}')
+        try:
+            with open_writer(dest, self.volume_size) as f, \
+                    self.archive(f, level=self.compression_level, workers=self.workers) as archive:
+                if level == Snapshot.FULL:
+                    archive.add_entries(scanned, arcname=src_basename)
+                else:
+                    self._add_changes(archive, src_basename, snapshot, level, entries, scanned)
+                source_size = archive.source_size()
+        except BaseException:
+            # the next run would skip the source if a partial archive was left behind (completed volumes are kept)
+            Path(dest).unlink(missing_ok=True)
+            raise
+
+        # the state is only updated once the archive is complete
+        if snapshot:
+            snapshot.update(level, self.date, entries)
+            snapshot.save()
+        dest_size = f.tell()
+        ratio = f', {dest_size / source_size:.1%}' if source_size else ''
+        volumes = f', {len(f.volumes)} volumes' if isinstance(f, VolumeWriter) else ''
+        return FileResult.add([
+            self.src,
+            sizeof(self.src, scanned),
+            convert_size(dest_size) + f' (compressed{ratio})',
+            self._excluded(scanner, archive.skipped),
+            f'{self.archive.FORMAT} ({level}{volumes})',
             f'{Fore.GREEN}OK{Fore.RESET}'
         ])
 
-    # copy src to dest
+    def _add_changes(self, archive, src_basename: str, snapshot: Snapshot, level: str, entries: dict,
+                     scanned: list):
+        base_date, base = snapshot.base(level)
+        changed, deleted = Snapshot.changes(entries, base)
+        # files removed after the scan are skipped, the next archive will list them as deleted
+        by_path = {entry.relpath: entry for entry in scanned}
+        archive.add_entries((by_path[path] for path in changed), arcname=src_basename)
+
+        changes = json.dumps({
+            'level': level,
+            'base': base_date,
+            'deleted': [f'{src_basename}/{path}' for path in deleted]
+        }).encode()
+        archive.add_bytes(self.CHANGES_MEMBER, changes, time())
+
+    # copy src to dest, or hardlink the copy of the last backup if src hasn't been changed since
     def file_backup(self):
         src_basename = os.path.basename(self.src)
         dest = f'{self.path}{src_basename}'
         if os.path.isfile(dest):
-            if os.path.getsize(self.src) == os.path.getsize(dest):
+            if self._unchanged(self.src, dest):
                 Printer.print(f'{Fore.YELLOW}{dest} already exist. Skipping!{Fore.RESET}')
-                return FileResult.data.append([
+                return FileResult.add([
                     self.src,
                     " ",
                     " ",
+                    " ",
+                    " ",
                     f'{Fore.YELLOW}Skipped{Fore.RESET}'
                 ])
             else:
-                Printer.print(f'{Fore.YELLOW}{dest} already exist, but size differs!{Fore.RESET}')
+                Printer.print(f'{Fore.YELLOW}{dest} already exist, but differs!{Fore.RESET}')
                 os.remove(dest)
+
+        previous = self._previous_copy(src_basename)
+        if previous and self._unchanged(self.src, previous, strict=True):
+            try:
+                os.link(previous, dest)
+                Printer.print(f'{Fore.YELLOW}{self.src} is unchanged, linked {previous} to {dest}.{Fore.RESET}')
+                return FileResult.add([
+                    self.src,
+                    sizeof(self.src),
+                    convert_size(os.path.getsize(dest)),
+                    " ",
+                    'hardlink',
+                    f'{Fore.GREEN}OK{Fore.RESET}'
+                ])
+            except OSError as e:
+                # e.g. different filesystems or too many links, fall back to a real copy
+                Printer.print(f'{Fore.YELLOW}Unable to link {previous} ({e}), copying instead.{Fore.RESET}', 0)
+
         Printer.print(f'{Fore.YELLOW}Copying {self.src} to {dest}.{Fore.RESET}')
-        copyfile(self.src, dest)
-        return FileResult.data.append([
+        # reflinks and in kernel copies don't pass the data through Python, so it's hashed later by Checksums
+        strategy = zero_copy(self.src, dest)
+        if strategy:
+            copystat(self.src, dest)
+        else:
+            strategy = BUFFERED
+            with open(self.src, 'rb') as fsrc, HashingWriter.open(dest, stat_from=self.src) as fdst:
+                copyfileobj(fsrc, fdst, self._COPY_BUFSIZE)
+        return FileResult.add([
             self.src,
             sizeof(self.src),
             convert_size(os.path.getsize(dest)),
+            " ",
+            strategy,
             f'{Fore.GREEN}OK{Fore.RESET}'
         ])
+
+    # skipped are entries the backup can't store (e.g. sockets, or fifos and devices of zip and dedup backups)
+    @staticmethod
+    def _excluded(scanner: TreeScanner, skipped: int = 0) -> str:
+        excluded = list()
+        if scanner.excluded():
+            excluded.append(f'{scanner.excluded_files} files ({convert_size(scanner.excluded_bytes)})')
+        if scanner.pruned_dirs:
+            excluded.append(f'{scanner.pruned_dirs} dirs')
+        if skipped:
+            excluded.append(f'{skipped} skipped')
+        return ', '.join(excluded) or " "
+
+    # the copy of src in the most recent backup folder before today
+    def _previous_copy(self, src_basename: str) -> str:
+        dates = sorted((d for d in os.listdir(self.backup_dir) if self._is_date(d) and d < self.date), reverse=True)
+        for date in dates:
+            path = os.path.join(self.backup_dir, date, src_basename)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    # quick check by size and mtime, the fingerprints of both files are compared if the mtime differs (or strict)
+    def _unchanged(self, src: str, dest: str, strict: bool = False) -> bool:
+        src_stat, dest_stat = os.stat(src), os.stat(dest)
+        if src_stat.st_size != dest_stat.st_size:
+            return False
+        if src_stat.st_mtime_ns == dest_stat.st_mtime_ns and not strict:
+            return True
+        if src_stat.st_mtime_ns != dest_stat.st_mtime_ns and strict:
+            return False
+
+        cache = ChecksumCache(self.cache_path) if self.cache_path else None
+        try:
+            cl = ChecksumLib(cache=cache)
+            return cl.get_fingerprint(src) == cl.get_fingerprint(dest)
+        finally:
+            if cache:
+                cache.close()
+
+    @staticmethod
+    def _is_date(name: str) -> bool:
+        try:
+            datetime.strptime(name, "%Y-%m-%d")
+        except ValueError:
+            return False
+        return True
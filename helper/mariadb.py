@@ -6,6 +6,7 @@ import os
 
 from . import Printer, DatabaseResult, secure, convert_size
 from .database.db import Database
+from .scheduler import DumpScheduler
 
 
 class MariaDB:
@@ -18,43 +19,61 @@ class MariaDB:
                  databases: list = list(),
                  path: str = '/home/backups',
                  container: Container = None,
-                 skip_existing: bool = True):
-        self._db = Database("mysql", host, port, username, password, path, container, skip_existing)
+                 skip_existing: bool = True,
+                 volume_size: int = 0,
+                 stream: bool = True,
+                 compression_level: int = 6,
+                 skip_unchanged: bool = True,
+                 mode: str = 'database',
+                 jobs: int = 1,
+                 single_transaction: bool = False):
+        self._db = Database("mysql", host, port, username, password, path, container, skip_existing,
+                            volume_size=volume_size, stream=stream, compression_level=compression_level,
+                            skip_unchanged=skip_unchanged, mode=mode, jobs=jobs,
+                            single_transaction=single_transaction)
         self.databases: list = databases or ['mysql']
         self.container = container
+        # the container (or host:port of a local database), used by the DumpScheduler and in the results
+        self.server: str = container.name if container else f'{host}:{port}'
 
-    def backup(self):
+    def backup(self, scheduler: DumpScheduler = None):
+        """dump all databases, or only queue the dumps if a scheduler is given"""
+        backup = self.docker_exec if self.container else self.exec
         for database in self.databases:
-            self.docker_exec(database) if self.container else self.exec(database)
+            if scheduler:
+                scheduler.submit(self.server, backup, database)
+            else:
+                backup(database)
 
     def docker_exec(self, db: str):
         try:
             result = self._db.backup_db(db)
         except:
-            return DatabaseResult.data.append([
+            return DatabaseResult.add([
                 "MariaDB",
-                self.container.name,
+                self.server,
                 db,
                 " ",
                 f'{Fore.RED}Failed{Fore.RESET}'
             ])
 
         if not result:
-            return DatabaseResult.data.append([
+            return DatabaseResult.add([
                 "MariaDB",
-                self.container.name,
+                self.server,
                 db,
                 " ",
                 f'{Fore.YELLOW}Skipped{Fore.RESET}'
             ])
 
-        return DatabaseResult.data.append([
+        return DatabaseResult.add([
             "MariaDB",
-            self.container.name,
+            self.server,
             db,
             convert_size(result["size"]),
-            f'{Fore.GREEN}OK{Fore.RESET}'
+            f'{Fore.GREEN}Unchanged{Fore.RESET}' if result.get("unchanged") else f'{Fore.GREEN}OK{Fore.RESET}'
         ])
 
+    # local databases are dumped by a subprocess instead of the container, the rest is the same
     def exec(self, db: str):
-        pass
+        return self.docker_exec(db)
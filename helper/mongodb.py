@@ -8,6 +8,7 @@ from tarfile import is_tarfile
 
 from . import Printer, DatabaseResult, secure, remove_timestamp, convert_size
 from .database.db import Database
+from .scheduler import DumpScheduler
 
 
 import logging
@@ -27,46 +28,61 @@ class MongoDB:
                  databases: list = list(),
                  path: str = '/home/backups',
                  container: Container = None,
-                 skip_existing: bool = True):
+                 skip_existing: bool = True,
+                 volume_size: int = 0,
+                 stream: bool = True,
+                 compression_level: int = 6,
+                 skip_unchanged: bool = True,
+                 parallel_collections: int = 4):
         self._db = Database("mongodb", host, port, username, password, path, container, skip_existing,
-                            authentication_database, authentication_mechanism)
+                            authentication_database, authentication_mechanism, volume_size=volume_size,
+                            stream=stream, compression_level=compression_level, skip_unchanged=skip_unchanged,
+                            parallel_collections=parallel_collections)
         self.databases: list = databases or ['admin']
         self.container = container
+        # the container (or host:port of a local database), used by the DumpScheduler and in the results
+        self.server: str = container.name if container else f'{host}:{port}'
 
 
-    def backup(self):
+    def backup(self, scheduler: DumpScheduler = None):
+        """dump all databases, or only queue the dumps if a scheduler is given"""
+        backup = self.docker_exec if self.container else self.exec
         for database in self.databases:
-            self.docker_exec(database) if self.container else self.exec(database)
+            if scheduler:
+                scheduler.submit(self.server, backup, database)
+            else:
+                backup(database)
 
     def docker_exec(self, db: str):
         try:
             result = self._db.backup_db(db)
         except Exception as e:
             logger.warning("%s", e)
-            return DatabaseResult.data.append([
+            return DatabaseResult.add([
                 "MongoDB",
-                self.container.name,
+                self.server,
                 db,
                 " ",
                 f'{Fore.RED}Failed{Fore.RESET}'
             ])
 
         if not result:
-            return DatabaseResult.data.append([
+            return DatabaseResult.add([
                 "MongoDB",
-                self.container.name,
+                self.server,
                 db,
                 " ",
                 f'{Fore.YELLOW}Skipped{Fore.RESET}'
             ])
 
-        return DatabaseResult.data.append([
+        return DatabaseResult.add([
             "MongoDB",
-            self.container.name,
+            self.server,
             db,
             convert_size(result["size"]),
-            f'{Fore.GREEN}OK{Fore.RESET}'
+            f'{Fore.GREEN}Unchanged{Fore.RESET}' if result.get("unchanged") else f'{Fore.GREEN}OK{Fore.RESET}'
         ])
 
+    # local databases are dumped by a subprocess instead of the container, the rest is the same
     def exec(self, db: str):
-        pass
+        return self.docker_exec(db)
@@ -6,6 +6,7 @@ import os
 
 from . import Printer, DatabaseResult, secure, remove_timestamp, convert_size
 from .database.db import Database
+from .scheduler import DumpScheduler
 
 
 class PostgreSQL:
@@ -18,43 +19,60 @@ class PostgreSQL:
                  databases: list = list(),
                  path: str = '/home/backups',
                  container: Container = None,
-                 skip_existing: bool = True):
-        self._db = Database("postgres", host, port, username, password, path, container, skip_existing)
+                 skip_existing: bool = True,
+                 volume_size: int = 0,
+                 stream: bool = True,
+                 compression_level: int = 6,
+                 skip_unchanged: bool = True,
+                 dump_format: str = 'plain',
+                 jobs: int = 1):
+        self._db = Database("postgres", host, port, username, password, path, container, skip_existing,
+                            volume_size=volume_size, stream=stream,
+                            compression_level=compression_level, skip_unchanged=skip_unchanged,
+                            dump_format=dump_format, jobs=jobs)
         self.databases: list = databases or ['postgres']
         self.container = container
+        # the container (or host:port of a local database), used by the DumpScheduler and in the results
+        self.server: str = container.name if container else f'{host}:{port}'
 
-    def backup(self):
+    def backup(self, scheduler: DumpScheduler = None):
+        """dump all databases, or only queue the dumps if a scheduler is given"""
+        backup = self.docker_exec if self.container else self.exec
         for database in self.databases:
-            self.docker_exec(database) if self.container else self.exec(database)
+            if scheduler:
+                scheduler.submit(self.server, backup, database)
+            else:
+                backup(database)
 
     def docker_exec(self, db: str):
         try:
             result = self._db.backup_db(db)
         except:
-            return DatabaseResult.data.append([
+            return DatabaseResult.add([
                 "PostgreSQL",
-                self.container.name,
+                self.server,
                 db,
                 " ",
                 f'{Fore.RED}Failed{Fore.RESET}'
             ])
 
         if not result:
-            return DatabaseResult.data.append([
+            return DatabaseResult.add([
                 "PostgreSQL",
-                self.container.name,
+                self.server,
                 db,
                 " ",
                 f'{Fore.YELLOW}Skipped{Fore.RESET}'
             ])
 
-        return DatabaseResult.data.append([
+        return DatabaseResult.add([
             "PostgreSQL",
-            self.container.name,
+            self.server,
             db,
             convert_size(result["size"]),
-            f'{Fore.GREEN}OK{Fore.RESET}'
+            f'{Fore.GREEN}Unchanged{Fore.RESET}' if result.get("unchanged") else f'{Fore.GREEN}OK{Fore.RESET}'
         ])
 
-    def exec(self, db):
-        pass
+    # local databases are dumped by a subprocess instead of the container, the rest is the same
+    def exec(self, db: str):
+        return self.docker_exec(db)
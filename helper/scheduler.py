@@ -0,0 +1,47 @@
+import logging
+
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class DumpScheduler:
+    """
+    Runs database dumps concurrently: at most workers dumps at once and at most per_container dumps of the same
+    container (or database server), so a single server isn't hammered while the others are idle.
+    Jobs are started in the order they have been submitted, skipping those whose container is busy.
+    """
+
+    def __init__(self, workers: int = 4, per_container: int = 1):
+        self.workers = max(1, workers or 1)
+        self.per_container = max(1, per_container or 1)
+        self._jobs: List[Tuple[str, Callable, tuple]] = list()
+
+    def submit(self, key: str, fn: Callable, *args):
+        """queue fn(*args), key identifies the container or database server the dump runs against"""
+        self._jobs.append((key, fn, args))
+
+    def run(self):
+        """run all queued jobs and wait for them, a failing job is logged and doesn't stop the others"""
+        queued, self._jobs = self._jobs, list()
+        running, pending = Counter(), dict()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while queued or pending:
+                for job in list(queued):
+                    if len(pending) >= self.workers:
+                        break
+                    key, fn, args = job
+                    if running[key] >= self.per_container:
+                        continue
+                    queued.remove(job)
+                    running[key] += 1
+                    pending[executor.submit(fn, *args)] = key
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running[pending.pop(future)] -= 1
+                    if future.exception():
+                        logger.error("Database dump failed", exc_info=future.exception())
@@ -1,8 +1,11 @@
 from datetime import datetime
 from prettytable import PrettyTable
+import threading
 import re
 import os
 
+from .file.scanner import TreeScanner
+
 
 class Printer:
     """
@@ -36,6 +39,13 @@ class Result:
     table: PrettyTable = PrettyTable()
     title: str = ''
     alignments: list = []
+    _lock = threading.Lock()
+
+    # backups run in several threads, so rows are only appended while holding the lock
+    @classmethod
+    def add(cls, row: list):
+        with cls._lock:
+            cls.data.append(row)
 
     def print(self):
         if self.data:
@@ -49,11 +59,11 @@ class Result:
 
 
 class FileResult(Result):
-    header: list = ["Path", "Source Size", "Destination Size", "Status"]
+    header: list = ["Path", "Source Size", "Destination Size", "Excluded", "Method", "Status"]
     data: list = list()
     table: PrettyTable = PrettyTable()
     title: str = "File Backup Status"
-    alignments: list = [('Path', 'l'), ('Source Size', 'r'), ('Destination Size', 'r')]
+    alignments: list = [('Path', 'l'), ('Source Size', 'r'), ('Destination Size', 'r'), ('Excluded', 'r')]
 
 
 class DatabaseResult(Result):
@@ -125,13 +135,11 @@ def convert_time(seconds):
 
 
 # size of a specific path including all subdirectories
-def sizeof(start):
-    if os.path.isfile(start):
-        return convert_size(os.path.getsize(start))
-    size = 0
-    for path, folder, files in os.walk(start):
-        for file in files:
-            file = os.path.join(path, file)
-            if not os.path.islink(file):
-                size += os.path.getsize(file)
+# entries of an earlier TreeScanner run of start are reused instead of walking the tree again
+def sizeof(start, entries=None):
+    if entries is None:
+        if os.path.isfile(start):
+            return convert_size(os.path.getsize(start))
+        entries = TreeScanner(start).scan()
+    size = sum(entry.stat.st_size for entry in entries if entry.is_file())
     return convert_size(size) if size else 'empty'
@@ -0,0 +1,45 @@
+#!/usr/bin/python3.8
+
+from argparse import ArgumentParser
+from pathlib import Path
+import os
+import json
+
+from config import create_from_json
+from helper import ChunkStore
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='restore deduplicated file backups')
+    parser.add_argument('-c', '--config', help='config file', nargs=1)
+    parser.add_argument('-s', '--source', help='name of the source to restore (default: all)', action='append')
+    parser.add_argument('date', help='date of the backup (YYYY-MM-DD)')
+    parser.add_argument('target', help='directory the files are restored to')
+
+    # get arguments
+    args = vars(parser.parse_args())
+    config_file: str = args.get('config')[0] if args.get('config') else './.config.json'
+
+    if not os.path.isfile(config_file):
+        print(f"{config_file} is not a file!")
+        exit(1)
+
+    json_object: dict = {}
+    try:
+        json_object: dict = json.loads(open(config_file).read())
+    except ValueError:
+        print(f'{config_file} does not contain valid json.')
+        exit(1)
+
+    config_obj = create_from_json(json_object)
+    store = ChunkStore(config_obj.backup_dir)
+    indexes = sorted((Path(config_obj.backup_dir) / args.get('date')).glob(f'*{ChunkStore.INDEX_SUFFIX}'))
+    if args.get('source'):
+        indexes = [i for i in indexes if i.name[:-len(ChunkStore.INDEX_SUFFIX)] in args.get('source')]
+    if not indexes:
+        print(f"No deduplicated backups found for {args.get('date')}!")
+        exit(1)
+
+    for index in indexes:
+        print(f'Restoring {index.name[:-len(ChunkStore.INDEX_SUFFIX)]} to {args.get("target")}')
+        store.restore(index, Path(args.get('target')))
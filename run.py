@@ -10,21 +10,37 @@ import platform
 import logging
 
 from config import Config, create_from_json
-from helper import Printer, DatabaseResult, FileResult, MariaDB, MongoDB, PostgreSQL, GitLab, File, Checksums
+from helper import convert_size, Printer, DatabaseResult, FileResult, MariaDB, MongoDB, PostgreSQL, GitLab, File, Checksums, \
+    InlineDigests, ChunkStore, DumpScheduler
 
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
 
 
+# the container of a database config, None for local databases and False if the container doesn't exist
+def find_container(db_config):
+    if db_config.local:
+        return None
+    container = list(filter(lambda c: c.name == db_config.container_name, docker_env().containers.list()))
+    if not container:
+        Printer.print(f'Database Container {db_config.container_name} does not exist. Skipping!', 2)
+        return False
+    return container[0]
+
+
 def main(config: Config, tasks: list):
+    # the artifacts are hashed while they are written, so the checksums don't have to read them again
+    InlineDigests.methods = set(config.checksums.methods)
+
     # check if the backup directory exists
     for task in tasks:
         if task == 'database':
+            # the dumps are queued by the backup() calls and run concurrently afterwards
+            scheduler = DumpScheduler(config.databases.workers, config.databases.per_container)
             for mariadb in config.mariadb:
-                container = list(filter(lambda c: c.name == mariadb.container_name, docker_env().containers.list()))
-                if not container:
-                    Printer.print(f'Database Container {mariadb.container_name} does not exist. Skipping!', 2)
+                container = find_container(mariadb)
+                if container is False:
                     continue
                 MariaDB(
                     path=config.backup_dir,
@@ -34,13 +50,19 @@ def main(config: Config, tasks: list):
                     password=mariadb.password,
                     databases=mariadb.databases,
                     skip_existing=mariadb.skip_existing,
-                    container=container[0]
-                ).backup()
+                    volume_size=config.volume_size,
+                    stream=config.databases.stream,
+                    compression_level=config.databases.compression_level,
+                    skip_unchanged=config.databases.skip_unchanged,
+                    mode=mariadb.mode,
+                    jobs=mariadb.jobs,
+                    single_transaction=mariadb.single_transaction,
+                    container=container
+                ).backup(scheduler)
 
             for mongodb in config.mongodb:
-                container = list(filter(lambda c: c.name == mongodb.container_name, docker_env().containers.list()))
-                if not container:
-                    Printer.print(f'Database Container {mongodb.container_name} does not exist. Skipping!', 2)
+                container = find_container(mongodb)
+                if container is False:
                     continue
                 MongoDB(
                     path=config.backup_dir,
@@ -50,13 +72,17 @@ def main(config: Config, tasks: list):
                     password=mongodb.password,
                     databases=mongodb.databases,
                     skip_existing=mongodb.skip_existing,
-                    container=container[0]
-                ).backup()
+                    volume_size=config.volume_size,
+                    stream=config.databases.stream,
+                    compression_level=config.databases.compression_level,
+                    skip_unchanged=config.databases.skip_unchanged,
+                    parallel_collections=mongodb.parallel_collections,
+                    container=container
+                ).backup(scheduler)
 
             for postgres in config.postgres:
-                container = list(filter(lambda c: c.name == postgres.container_name, docker_env().containers.list()))
-                if not container:
-                    Printer.print(f'Database Container {postgres.container_name} does not exist. Skipping!', 2)
+                container = find_container(postgres)
+                if container is False:
                     continue
                 PostgreSQL(
                     path=config.backup_dir,
@@ -66,13 +92,35 @@ def main(config: Config, tasks: list):
                     password=postgres.password,
                     databases=postgres.databases,
                     skip_existing=postgres.skip_existing,
-                    container=container[0]
+                    volume_size=config.volume_size,
+                    stream=config.databases.stream,
+                    compression_level=config.databases.compression_level,
+                    skip_unchanged=config.databases.skip_unchanged,
+                    dump_format=postgres.format,
+                    jobs=postgres.jobs,
+                    container=container
+                ).backup(scheduler)
+            scheduler.run()
+
+        elif task == 'files' and config.files.paths:
+            for source in config.files.sources:
+                File(
+                    src=source['path'],
+                    path=config.backup_dir,
+                    workers=config.files.workers,
+                    compression_level=config.files.compression_level,
+                    mode=config.files.mode,
+                    full_interval=config.files.full_interval,
+                    storage=config.files.storage,
+                    cache=config.checksums.cache,
+                    archive_format=config.files.format,
+                    scan_workers=config.files.scan_workers,
+                    include=source.get('include') or config.files.include,
+                    exclude=config.files.exclude + (source.get('exclude') or list()),
+                    max_file_size=source.get('max_file_size') or config.files.max_file_size,
+                    volume_size=config.volume_size
                 ).backup()
 
-        elif task == 'files' and config.files:
-            for file in config.files:
-                File(src=file, path=config.backup_dir).backup()
-
         elif task == 'gitlab' and config.gitlab:
             container = list(filter(lambda c: c.name == config.gitlab.container_name, docker_env().containers.list()))
             if not container:
@@ -80,8 +128,13 @@ def main(config: Config, tasks: list):
                 continue
             GitLab(container[0]).backup()
 
+        elif task == 'gc':
+            removed, freed = ChunkStore(config.backup_dir).collect_garbage()
+            Printer.print(f'Removed {removed} unreferenced chunks ({convert_size(freed)})')
+
     # Generate Checksums
-    checksums = Checksums(path=config.backup_dir)
+    checksums = Checksums(path=config.backup_dir, methods=config.checksums.methods, workers=config.checksums.workers,
+                          cache=config.checksums.cache, use_mmap=config.checksums.mmap)
     checksums.generate_all()
 
     # Reporting
@@ -104,6 +157,9 @@ if __name__ == '__main__':
     parser.add_argument('-d', '--database', help='backup databases', action="store_true")
     parser.add_argument('--gitlab', help='backup gitlab', action="store_true")
     parser.add_argument('-f', '--files', help='backup files', action="store_true")
+    parser.add_argument('--gc', help='remove chunks which are not referenced by any backup', action="store_true")
+    parser.add_argument('--checksum-workers', help='number of files to hash concurrently', type=int)
+    parser.add_argument('--database-workers', help='number of database dumps to run concurrently', type=int)
 
     # get arguments
     args = vars(parser.parse_args())
@@ -123,6 +179,9 @@ if __name__ == '__main__':
             jobs.append('gitlab')
         if args.get('files'):
             jobs.append('files')
+    # garbage collection runs after all backups
+    if args.get('gc'):
+        jobs.append('gc')
 
     # check if jobs have been selected
     if not jobs:
@@ -152,5 +211,9 @@ if __name__ == '__main__':
 
     config_obj = create_from_json(json_object)
     config_obj.validate()
+    if args.get('checksum_workers'):
+        config_obj.checksums.workers = args.get('checksum_workers')
+    if args.get('database_workers'):
+        config_obj.databases.workers = args.get('database_workers')
     START = time()
     main(config_obj, jobs)
@@ -0,0 +1,55 @@
+import os
+import stat
+import tempfile
+import unittest
+import zipfile
+
+from pathlib import Path
+
+from helper.file.archive import ZipArchive
+from helper.file.scanner import TreeScanner
+
+
+class ZipArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = Path(self.tmp.name) / 'src'
+        (self.src / 'd').mkdir(parents=True)
+        (self.src / 'd' / 'file').write_bytes(b'content' * 100)
+        os.symlink('d/file', self.src / 'link')
+        self.dest = Path(self.tmp.name) / 'src.zip'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_symlinks_are_stored_as_links(self):
+        with self.dest.open('wb') as f, ZipArchive(f) as archive:
+            archive.add_entries(TreeScanner(self.src).scan(), arcname='src')
+        self.assertEqual(archive.links, 1)
+        with zipfile.ZipFile(self.dest) as z:
+            link = z.getinfo('src/link')
+            self.assertTrue(stat.S_ISLNK(link.external_attr >> 16))
+            self.assertEqual(z.read(link), b'd/file')
+            self.assertEqual(z.read('src/d/file'), b'content' * 100)
+
+    def test_failed_archive_is_not_complete(self):
+        with self.assertRaises(RuntimeError), self.dest.open('wb') as f, ZipArchive(f) as archive:
+            archive.add_entries(TreeScanner(self.src).scan(), arcname='src')
+            raise RuntimeError('failed')
+        self.assertFalse(ZipArchive.is_archive(self.dest))
+
+    def test_timestamps_before_1980(self):
+        os.utime(self.src / 'd' / 'file', (0, 0))
+        os.utime(self.src / 'd', (0, 0))
+        with self.dest.open('wb') as f, ZipArchive(f) as archive:
+            archive.add_entries(TreeScanner(self.src).scan(), arcname='src')
+            archive.add(self.src / 'd', arcname='added')
+        with zipfile.ZipFile(self.dest) as z:
+            for name in ('src/d/', 'src/d/file', 'added/', 'added/file'):
+                self.assertEqual(z.getinfo(name).date_time, (1980, 1, 1, 0, 0, 0))
+            self.assertEqual(z.read('src/d/file'), b'content' * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
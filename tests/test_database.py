@@ -0,0 +1,51 @@
+import json
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from helper.database.sqldb import MySQL
+
+
+class LocalServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def server(self, port: int, **kwargs) -> MySQL:
+        server = MySQL(port=port, path=str(self.path), skip_unchanged=False, **kwargs)
+
+        def dump(db: str, path: Path) -> dict:
+            path.write_bytes(f'{db} of {port}'.encode())
+            return {'name': path.name, 'size': path.stat().st_size}
+        server._local_db = dump
+        return server
+
+    def test_servers_with_the_same_database(self):
+        first, second = self.server(3306), self.server(3307)
+        self.assertIsNotNone(first.backup_db('mysql'))
+        self.assertIsNotNone(second.backup_db('mysql'))
+        dumps = sorted(self.path.glob('*/*/mysql.*'))
+        self.assertEqual([dump.parent.name for dump in dumps], ['mysql_localhost_3306', 'mysql_localhost_3307'])
+        self.assertEqual([dump.read_bytes() for dump in dumps], [b'mysql of 3306', b'mysql of 3307'])
+
+    def test_link_a_dump_of_the_former_folder(self):
+        server = self.server(3306)
+        previous = self.path / '2020-01-01' / 'mysql' / 'mysql.sql.gz'
+        previous.parent.mkdir(parents=True)
+        previous.write_bytes(b'dump')
+        _, target = server._dump_target('mysql')
+        state = {'marker': 'm', 'date': '2020-01-01', 'name': target.name, 'size': 4,
+                 'files': [str(previous.relative_to(self.path))]}
+        server._state_path('mysql').parent.mkdir(parents=True)
+        server._state_path('mysql').write_text(json.dumps(state))
+        self.assertTrue(server._link_unchanged('mysql', target, 'm')['unchanged'])
+        self.assertEqual(target.read_bytes(), b'dump')
+
+
+if __name__ == '__main__':
+    unittest.main()
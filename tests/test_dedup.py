@@ -0,0 +1,139 @@
+import os
+import random
+import tempfile
+import unittest
+
+from io import BytesIO
+from pathlib import Path
+
+from helper.checksums import Checksums
+from helper.file.dedup import ChunkStore
+from helper.file.manifest import Manifest
+
+
+def random_bytes(size: int, seed: int = 0) -> bytes:
+    return random.Random(seed).getrandbits(size * 8).to_bytes(size, 'little')
+
+
+class IterChunksTest(unittest.TestCase):
+
+    def test_chunks_cover_the_content(self):
+        data = random_bytes(10 * 1024 * 1024)
+        chunks = list(ChunkStore.iter_chunks(BytesIO(data)))
+        self.assertEqual(b''.join(chunks), data)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), ChunkStore._MIN_CHUNK)
+            self.assertLessEqual(len(chunk), ChunkStore._MAX_CHUNK)
+
+    def test_empty_file(self):
+        self.assertEqual(list(ChunkStore.iter_chunks(BytesIO(b''))), [])
+
+    def test_boundaries_survive_an_insertion(self):
+        data = random_bytes(10 * 1024 * 1024)
+        before = set(ChunkStore.iter_chunks(BytesIO(data)))
+        after = list(ChunkStore.iter_chunks(BytesIO(b'inserted' + data)))
+        # only the chunks around the insertion differ
+        self.assertLessEqual(len([chunk for chunk in after if chunk not in before]), 2)
+
+    def test_boundaries_of_text_survive_an_insertion(self):
+        rnd = random.Random(0)
+        words = [''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rnd.randint(2, 9)))
+                 for _ in range(1000)]
+        data = ''.join(f"INSERT INTO `log` VALUES ({i},'{rnd.choice(words)} {rnd.choice(words)}',"
+                       f"'2020-01-{rnd.randint(10, 28)} 12:00:00',{rnd.randint(0, 99999)});\n"
+                       for i in range(120000)).encode()
+        before = set(ChunkStore.iter_chunks(BytesIO(data)))
+        after = list(ChunkStore.iter_chunks(BytesIO(b' ' + data)))
+        self.assertGreater(len(after), 4)
+        self.assertLessEqual(len([chunk for chunk in after if chunk not in before]), 2)
+
+
+class ChunkStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base = Path(self.tmp.name)
+        self.backup_dir = self.base / 'backups'
+        (self.backup_dir / '2020-01-01').mkdir(parents=True)
+        (self.backup_dir / '2020-01-02').mkdir()
+        self.src = self.base / 'data'
+        (self.src / 'sub').mkdir(parents=True)
+        (self.src / 'big.bin').write_bytes(random_bytes(3 * 1024 * 1024))
+        (self.src / 'sub' / 'small.txt').write_bytes(b'small')
+        (self.src / 'empty').write_bytes(b'')
+        os.chmod(self.src / 'sub' / 'small.txt', 0o640)
+        os.utime(self.src / 'sub' / 'small.txt', ns=(1_000_000_000, 1_000_000_000))
+        os.symlink('sub/small.txt', self.src / 'link')
+        self.store = ChunkStore(str(self.backup_dir))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def index(self, date: str, name: str = 'data') -> Path:
+        return self.backup_dir / date / f'{name}{ChunkStore.INDEX_SUFFIX}'
+
+    def test_round_trip(self):
+        size, stored, skipped = self.store.backup(str(self.src), self.index('2020-01-01'))
+        self.assertEqual(size, 3 * 1024 * 1024 + 5)
+        self.assertGreater(stored, 0)
+        self.assertEqual(skipped, 0)
+
+        target = self.base / 'restore'
+        self.store.restore(self.index('2020-01-01'), target)
+        for name in ('big.bin', 'sub/small.txt', 'empty'):
+            self.assertEqual((target / 'data' / name).read_bytes(), (self.src / name).read_bytes())
+        restored = (target / 'data' / 'sub' / 'small.txt').stat()
+        self.assertEqual(restored.st_mode & 0o777, 0o640)
+        self.assertEqual(restored.st_mtime_ns, 1_000_000_000)
+        self.assertEqual(os.readlink(target / 'data' / 'link'), 'sub/small.txt')
+
+    def test_restore_into_existing_tree(self):
+        self.store.backup(str(self.src), self.index('2020-01-01'))
+        target = self.base / 'restore'
+        self.store.restore(self.index('2020-01-01'), target)
+        (target / 'data' / 'sub' / 'small.txt').write_bytes(b'changed')
+        self.store.restore(self.index('2020-01-01'), target)
+        self.assertEqual((target / 'data' / 'sub' / 'small.txt').read_bytes(), b'small')
+        self.assertEqual(os.readlink(target / 'data' / 'link'), 'sub/small.txt')
+
+    def test_unchanged_content_is_stored_once(self):
+        self.store.backup(str(self.src), self.index('2020-01-01'))
+        _, stored, _ = self.store.backup(str(self.src), self.index('2020-01-02'))
+        self.assertEqual(stored, 0)
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), 'fifos are not supported')
+    def test_special_files_are_counted(self):
+        os.mkfifo(self.src / 'fifo')
+        _, _, skipped = self.store.backup(str(self.src), self.index('2020-01-01'))
+        self.assertEqual(skipped, 1)
+
+    def test_collect_garbage(self):
+        self.store.backup(str(self.src), self.index('2020-01-01'))
+        (self.src / 'big.bin').write_bytes(random_bytes(3 * 1024 * 1024, seed=1))
+        self.store.backup(str(self.src), self.index('2020-01-02'))
+        self.assertEqual(self.store.collect_garbage()[0], 0)
+
+        first = ChunkStore.referenced([self.index('2020-01-01')])
+        second = ChunkStore.referenced([self.index('2020-01-02')])
+        self.index('2020-01-01').unlink()
+        removed, freed = self.store.collect_garbage()
+        self.assertEqual(removed, len(first - second))
+        self.assertGreater(freed, 0)
+        for digest in second:
+            self.assertTrue((self.backup_dir / ChunkStore.chunk_path(digest)).is_file())
+        for digest in first - second:
+            self.assertFalse((self.backup_dir / ChunkStore.chunk_path(digest)).exists())
+
+    def test_manifest_lists_the_referenced_chunks(self):
+        checksums = Checksums(str(self.backup_dir), cache=False)
+        ChunkStore(str(self.backup_dir)).backup(str(self.src), checksums.path / f'data{ChunkStore.INDEX_SUFFIX}')
+        checksums.generate_all()
+        paths = {entry['path'] for entry in Manifest(checksums.path / Manifest.FILE_NAME)}
+        digests = ChunkStore.referenced([checksums.path / f'data{ChunkStore.INDEX_SUFFIX}'])
+        self.assertEqual({p for p in paths if p.startswith('../')},
+                         {f'../{ChunkStore.chunk_path(digest)}' for digest in digests})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from helper.file.exclude import PathFilter
+
+
+class PathFilterTest(unittest.TestCase):
+
+    def test_star_stays_within_a_directory(self):
+        path_filter = PathFilter(include=['docs/*.md'], exclude=['/build/*'])
+        self.assertTrue(path_filter.included('docs/a.md'))
+        self.assertFalse(path_filter.included('docs/a/b.md'))
+        self.assertTrue(path_filter.excluded(path_filter.exclude, 'build/out', True))
+        self.assertFalse(path_filter.excluded(path_filter.exclude, 'build/out/file', False))
+        self.assertFalse(path_filter.excluded(path_filter.exclude, 'src/build/out', False))
+
+    def test_double_star(self):
+        path_filter = PathFilter(include=['docs/**/*.md', 'a/**'])
+        self.assertTrue(path_filter.included('docs/a.md'))
+        self.assertTrue(path_filter.included('docs/a/b/c.md'))
+        self.assertTrue(path_filter.included('a/b/c'))
+        self.assertFalse(path_filter.included('b/docs/a.md'))
+
+    def test_name_patterns_match_at_any_depth(self):
+        path_filter = PathFilter(exclude=['*.log', 'cache/', 'ma[!x]n.?'])
+        rules = path_filter.exclude
+        self.assertTrue(path_filter.excluded(rules, 'a/b/c.log', False))
+        self.assertTrue(path_filter.excluded(rules, 'a/cache', True))
+        self.assertFalse(path_filter.excluded(rules, 'a/cache', False))
+        self.assertTrue(path_filter.excluded(rules, 'main.c', False))
+        self.assertFalse(path_filter.excluded(rules, 'maxn.c', False))
+
+    def test_ignore_file_rules_are_relative_to_their_directory(self):
+        path_filter = PathFilter()
+        rules = [('sub', 'tmp/*.txt'), ('sub', '[/]x')]
+        self.assertTrue(path_filter.excluded(rules, 'sub/tmp/a.txt', False))
+        self.assertFalse(path_filter.excluded(rules, 'sub/tmp/a/b.txt', False))
+        self.assertFalse(path_filter.excluded(rules, 'tmp/a.txt', False))
+        self.assertFalse(path_filter.excluded(rules, 'sub//x', False))
+
+
+if __name__ == '__main__':
+    unittest.main()
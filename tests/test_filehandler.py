@@ -0,0 +1,48 @@
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from helper.file.filehandler import FileHandler
+
+
+class IterReadViewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.a = Path(self.tmp.name) / 'a'
+        self.b = Path(self.tmp.name) / 'b'
+        self.a.write_bytes(b'A' * 300)
+        self.b.write_bytes(b'B' * 300)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_reads_the_whole_file(self):
+        data = Path(self.tmp.name) / 'data'
+        data.write_bytes(bytes(range(256)) * 1000)
+        chunks = [bytes(view) for view in FileHandler(chunk_size=1000).iter_read_view(data)]
+        self.assertEqual(b''.join(chunks), data.read_bytes())
+
+    def test_concurrent_generators_in_one_thread(self):
+        handler = FileHandler(chunk_size=100)
+        first, second = handler.iter_read_view(self.a), handler.iter_read_view(self.b)
+        a = next(first)
+        b = next(second)
+        self.assertEqual(bytes(a), b'A' * 100)
+        self.assertEqual(bytes(b), b'B' * 100)
+        self.assertEqual(b''.join(bytes(v) for v in first), b'A' * 200)
+        self.assertEqual(b''.join(bytes(v) for v in second), b'B' * 200)
+
+    def test_buffer_is_reused(self):
+        handler = FileHandler(chunk_size=100)
+        for _ in handler.iter_read_view(self.a):
+            pass
+        buffer = FileHandler._acquire_buffer(100)
+        FileHandler._release_buffer(buffer)
+        for view in handler.iter_read_view(self.b):
+            self.assertIs(view.obj, buffer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from helper.checksums import Checksums
+from helper.file.checksum import ChecksumLib
+from helper.file.merkle import MerkleTree
+
+
+def sha256(path: Path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+class MerkleTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name)
+        (self.path / 'a' / 'b').mkdir(parents=True)
+        (self.path / 'c').mkdir()
+        (self.path / 'a' / 'one').write_bytes(b'one')
+        (self.path / 'a' / 'b' / 'two').write_bytes(b'two')
+        (self.path / 'three').write_bytes(b'three')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def build(self) -> MerkleTree:
+        return MerkleTree.build(self.path, 'sha256', sha256, workers=2)
+
+    def test_build(self):
+        tree = self.build()
+        self.assertEqual(tree.nodes['a/one'], [MerkleTree.FILE, sha256(self.path / 'a' / 'one')])
+        self.assertEqual(tree.nodes['c'][0], MerkleTree.DIR)
+        self.assertEqual(tree.root, self.build().root)
+        self.assertEqual(tree.root, MerkleTree.from_digests('sha256', {
+            'a/one': sha256(self.path / 'a' / 'one'),
+            'a/b/two': sha256(self.path / 'a' / 'b' / 'two'),
+            'three': sha256(self.path / 'three')
+        }, ['c']).root)
+
+    def test_empty_directory(self):
+        with tempfile.TemporaryDirectory() as empty:
+            tree = MerkleTree.build(Path(empty), 'sha256', sha256)
+        self.assertEqual(tree.root, hashlib.sha256().hexdigest())
+        checksum = ChecksumLib().get_checksum_dir(Path(self.path / 'c'), 'sha256', merkle=True)
+        self.assertEqual(str(checksum), hashlib.sha256().hexdigest())
+
+    def test_shake(self):
+        checksum = ChecksumLib(length=16).get_checksum_dir(self.path, 'shake_128', merkle=True)
+        self.assertEqual(len(bytes(checksum)), 16)
+
+    def test_diff(self):
+        before = self.build()
+        (self.path / 'a' / 'b' / 'two').write_bytes(b'changed')
+        (self.path / 'three').unlink()
+        (self.path / 'c' / 'four').write_bytes(b'four')
+        after = self.build()
+        self.assertNotEqual(before.root, after.root)
+        self.assertEqual(after.diff(before), ['a/b/two', 'c/four', 'three'])
+        self.assertEqual(after.diff(after), [])
+
+    def test_diff_only_visits_changed_subtrees(self):
+        before = self.build()
+        (self.path / 'three').write_bytes(b'changed')
+        after = self.build()
+        # the unchanged subtree a is compared by its digest, its children are never looked at
+        del after.nodes['a/b/two'], before.nodes['a/b/two']
+        self.assertEqual(after.diff(before), ['three'])
+
+    def test_save_and_load(self):
+        tree = self.build()
+        tree.save(self.path / 'tree.json')
+        loaded = MerkleTree.load(self.path / 'tree.json')
+        self.assertEqual(loaded.root, tree.root)
+        self.assertEqual(loaded.nodes, json.loads(json.dumps(tree.nodes)))
+        self.assertEqual(loaded.diff(tree), [])
+
+
+class ChecksumsTreeTest(unittest.TestCase):
+
+    def test_trees_of_two_dates_are_compared(self):
+        with tempfile.TemporaryDirectory() as backup_dir:
+            checksums = Checksums(backup_dir, methods=['sha256', 'md5'], cache=False)
+            previous = Path(backup_dir) / '2000-01-01'
+            (previous / 'db').mkdir(parents=True)
+            (previous / 'db' / 'dump.sql').write_bytes(b'old')
+            (previous / 'file').write_bytes(b'same')
+            old = Checksums(backup_dir, methods=['sha256'], cache=False)
+            old.path = previous
+            old.generate_all()
+
+            (checksums.path / 'db').mkdir()
+            (checksums.path / 'db' / 'dump.sql').write_bytes(b'new')
+            (checksums.path / 'file').write_bytes(b'same')
+            checksums.generate_all()
+
+            tree = MerkleTree.load(checksums.path / MerkleTree.FILE_NAME)
+            self.assertEqual(tree.nodes['db/dump.sql'][1], hashlib.sha256(b'new').hexdigest())
+            self.assertNotIn('md5sum.txt', tree.nodes)
+            self.assertEqual(checksums.compare(checksums.path.name, previous.name), ['db/dump.sql'])
+            # running it again for the same date replaces the tree instead of including it
+            checksums.generate_all()
+            self.assertNotIn(MerkleTree.FILE_NAME, MerkleTree.load(checksums.path / MerkleTree.FILE_NAME).nodes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from helper.file.snapshot import Snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = Path(self.tmp.name) / 'src'
+        self.src.mkdir()
+        (self.src / 'file').write_bytes(b'data')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_mode_change_keeping_mtime(self):
+        base = Snapshot.scan(self.src)
+        st = (self.src / 'file').stat()
+        os.chmod(self.src / 'file', 0o600)
+        os.utime(self.src / 'file', ns=(st.st_atime_ns, st.st_mtime_ns))
+        changed, deleted = Snapshot.changes(Snapshot.scan(self.src), base)
+        self.assertEqual(changed, ['file'])
+        self.assertEqual(deleted, [])
+
+    def test_unchanged(self):
+        base = Snapshot.scan(self.src)
+        self.assertEqual(Snapshot.changes(Snapshot.scan(self.src), base), ([], []))
+
+    def test_state_path_is_keyed_by_absolute_path(self):
+        state = Path(self.tmp.name) / '.state'
+        first = Snapshot.state_path(state, '/srv/a/data')
+        self.assertEqual(first.name[:5], 'data.')
+        self.assertNotEqual(first, Snapshot.state_path(state, '/srv/b/data'))
+        self.assertEqual(first, Snapshot.state_path(state, '/srv/a/data/'))
+
+
+if __name__ == '__main__':
+    unittest.main()